@@ -5,7 +5,7 @@ import signal
 from threading import Thread, Lock
 from collections import deque
 	
-from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtCore import Qt, QObject, QTimer, pyqtSignal
 from PyQt5.QtWidgets import QApplication
 
 __all__ = ['singleton', 'spawn', 'qtmain', 'qtschedule', 'qtinvoke', 'qtquit']
@@ -53,31 +53,64 @@ def spawn(func):
 
 
 qttasks = deque()
-qttasks_timer = None
+qttasks_lock = Lock()
+qttasks_posted = False	# a dispatch is pending in the Qt event loop
+qttasks_dispatcher = None
+qtsignals_timer = None	# returns regularly to the python interpreter, so that it can handle the signals like Ctrl+C
+
+class TaskDispatcher(QObject):
+	''' wakes the Qt thread when tasks are scheduled, through a queued signal '''
+	wake = pyqtSignal()
+	
+	def __init__(self):
+		super().__init__()
+		self.wake.connect(self.process, Qt.QueuedConnection)
+	
+	def process(self):
+		''' execute all the tasks scheduled so far '''
+		global qttasks_posted
+		# tasks scheduled from now will need a new dispatch
+		with qttasks_lock:
+			qttasks_posted = False
+		while qttasks:
+			try:	qttasks.popleft() ()
+			except Exception:
+				traceback.print_exc()
+
 def qtmain(app=None):
 	''' create and run the QApplication and the Qt main loop '''
-	global qttasks_timer, qtstopped
+	global qttasks_dispatcher, qttasks_posted, qtsignals_timer, qtstopped
 	
 	if not app:	
 		app = QApplication(sys.argv)
 	
 	locale.setlocale(locale.LC_ALL, 'C')
 	
-	def process_tasks():
-		while qttasks:
-			qttasks.popleft() ()
-			
-	qttasks_timer = QTimer()
-	qttasks_timer.setInterval(50)
-	qttasks_timer.timeout.connect(process_tasks)
-	qttasks_timer.start()
+	qttasks_dispatcher = TaskDispatcher()
+	# run the tasks scheduled before the loop
+	with qttasks_lock:
+		qttasks_posted = True
+	qttasks_dispatcher.wake.emit()
+	
+	# python signal handlers only run when the Qt loop calls python code
+	qtsignals_timer = QTimer()
+	qtsignals_timer.setInterval(200)
+	qtsignals_timer.timeout.connect(lambda: None)
+	qtsignals_timer.start()
 	
 	qtstopped = False
 	app.exec()
 
 def qtschedule(callback):
-	''' put a task for the Qt thread to execute as soon as possible '''
+	''' put a task for the Qt thread to execute as soon as possible 
+		the Qt thread is woken only once for all the tasks scheduled until it processes them
+	'''
+	global qttasks_posted
 	qttasks.append(callback)
+	with qttasks_lock:
+		if qttasks_posted or not qttasks_dispatcher:	return
+		qttasks_posted = True
+	qttasks_dispatcher.wake.emit()
 
 def qtinvoke(callback):
 	''' same as qtschedule but wait for the task end '''
@@ -87,7 +120,7 @@ def qtinvoke(callback):
 	def wrapper():
 		try:	result[0] = callback()
 		except Exception as err:
-			print_exc()
+			traceback.print_exc()
 			result[1] = err
 		lock.release()
 	qtschedule(wrapper)
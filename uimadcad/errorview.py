@@ -120,6 +120,10 @@ class ErrorView(QWidget):
 					endline = line.find('\n')
 					cursor.insertText(line[:endline], fmt_traceback)
 					cursor.insertText(line[endline:], fmt_code)
+			# exceptions coming from an other process only have their traceback as text
+			remote = getattr(exception, 'remotetraceback', None)
+			if remote:
+				cursor.insertText(remote, fmt_traceback)
 		
 		# scroll on the end of the error message (most of the time the most interesting part)
 		cursor = self._text.textCursor()
@@ -14,7 +14,7 @@ from PyQt5.QtCore import (
 		Qt, QSize, QRect, QPoint, QPointF,
 		QEvent, pyqtSignal, QObject, 
 		QStringListModel,
-		QUrl,
+		QUrl, QTimer,
 		)
 from PyQt5.QtWidgets import (
 		QApplication, QVBoxLayout, QWidget, QHBoxLayout, QStyleFactory, QSplitter, QSizePolicy, QAction, QShortcut,
@@ -38,7 +38,7 @@ from madcad.rendering import Display, Group, Turntable, Orbit, Displayable
 from madcad.nprint import nprint, nformat, deformat
 
 from .common import *
-from .interpreter import Interpreter, InterpreterError, astinterval, astatpos
+from .interpreter import Interpreter, InterpreterError, ExecutionCancelled, astinterval, astatpos, shutdown
 from .scriptview import ScriptView
 from .sceneview import Scene, SceneView, SceneList, scene_unroll
 from .errorview import ErrorView
@@ -50,11 +50,12 @@ from . import tooling
 from . import settings
 
 from copy import deepcopy, copy
-from threading import Thread
+from threading import Thread, Lock
 from functools import partial
 import ast, traceback
 import os, sys
 import re
+import hashlib
 
 
 
@@ -85,6 +86,10 @@ class Madcad(QObject):
 		self.exectrigger = 1
 		self.exectarget = 0
 		self.execthread = None
+		self.execduration = 0	# average duration of the recent executions
+		self.exectimer = QTimer(self)	# delays the automatic executions to coalesce the editions
+		self.exectimer.setSingleShot(True)
+		self.exectimer.timeout.connect(self.execute)
 		self.editzone = [0,1]
 		self.editors = {}
 		self.details = {}
@@ -121,6 +126,10 @@ class Madcad(QObject):
 		self.startup()
 	
 	def close(self):
+		self.cancel_execution()
+		if self.currentfile:
+			self.interpreter.savecache(self.cachefile())
+		shutdown()
 		# close all the subwindows
 		for view in self.views:
 			view.close()
@@ -135,6 +144,10 @@ class Madcad(QObject):
 			madcad.settings.use_qt_colors()
 		if settings.scriptview['system_theme']:
 			settings.use_qt_colors()
+		self.interpreter.workers = settings.execution['parallel']
+		self.interpreter.isolated = settings.execution['isolated']
+		self.interpreter.backupmemory = settings.execution['backupmemory'] * 2**20
+		self.interpreter.spilldir = settings.locations['backups']
 		# load startup file
 		cursor = QTextCursor(self.script)
 		cursor.insertText(open(settings.locations['startup'], 'r').read())
@@ -258,6 +271,7 @@ class Madcad(QObject):
 		filename = os.path.abspath(filename)
 		os.chdir(os.path.split(filename)[0])
 		self.currentfile = filename
+		self.interpreter.loadcache(self.cachefile())
 		if extension in ('py', 'txt'):
 			self.script.clear()
 			import locale
@@ -290,6 +304,12 @@ class Madcad(QObject):
 		if not file:	file = self.currentfile
 		if not file:	raise ValueError('no file is given and no current file')
 		open(file, 'w').write(self.script.toPlainText())
+		if file == self.currentfile:
+			self.interpreter.savecache(self.cachefile())
+	
+	def cachefile(self):
+		''' file storing the execution results of the current file between sessions '''
+		return os.path.join(settings.locations['cache'], hashlib.sha1(os.path.abspath(self.currentfile).encode()).hexdigest())
 		
 	def _save(self):
 		if not self.currentfile:
@@ -342,7 +362,9 @@ class Madcad(QObject):
 		# transform it to fit the common standards
 		newtext = cursor.selectedText().replace('\u2029', '\n')
 		
-		# apply change to the interpeter
+		# apply change to the interpeter, the running execution is obsolete and finishes in the background
+		if self.execthread:
+			self.interpreter.cancel()
 		self.interpreter.change(position, removed, newtext)
 		
 		if self.exectarget > position:
@@ -351,18 +373,24 @@ class Madcad(QObject):
 			self.exectarget = position + added - removed
 		self.exectarget_changed.emit()
 		
+		self.execution_label('MODIFIED')
 		if self.exectrigger == 2 or self.exectrigger == 1 and '\n' in newtext:
-			self.execute()
-		else:
-			self.execution_label('MODIFIED')
+			self.schedule_execution()
+	
+	def schedule_execution(self):
+		''' execute after a delay without edition, the delay grows with the duration of the recent executions 
+			successive calls postpone the same execution, which runs to the exectarget of that time
+		'''
+		delay = settings.execution['triggerdelay']
+		delay = min(delay + self.execduration, 20*delay)
+		self.exectimer.start(int(delay*1000))
 	
 	def execute(self):
 		''' execute the script until the line exectarget 
 			updating the scene and the execution label
 		'''
-		if self.execthread:
-			self.execthread.join()
-		
+		self.exectimer.stop()
+		self.cancel_execution()
 		self.progressbar.show()
 		
 		# place the exec target at the end of line
@@ -373,17 +401,26 @@ class Madcad(QObject):
 		
 		self.execution_label('RUNNING')
 		self.interpreter.backups[0][1]['__file__'] = self.currentfile or './untitled.py'
+		if settings.execution['temporaries'] == 'all':
+			self.interpreter.capturezones = None
+		else:
+			self.interpreter.capturezones = list(self.displayzones.values())
 		
 		def job():
 			#print('-- execute script --\n{}\n-- end --'.format(self.interpreter.text))
 			try:
 				res = self.interpreter.execute(self.exectarget, 
 							autobackup=True, 
-							onstep=lambda x: qtschedule(lambda: self.progressbar.set_state(x)),
+							onstep=self.progressbar.post,
 							)
-			except InterpreterError as report:
+			except ExecutionCancelled:
+				pass
+			except Exception as report:
+				# an error of the interpreter itself must end the execution like an error of the script
+				if isinstance(report, InterpreterError):
+					report = report.args[0]
 				@qtschedule
-				def show(err=report.args[0]):
+				def show(err=report):
 					self.showerror(err)
 					self.execution_label('<p style="color:#ff5555">FAILED</p>')
 			else:
@@ -392,6 +429,9 @@ class Madcad(QObject):
 					self.execution_label('<p style="color:#55ff22">COMPUTED</p>')
 					self.hideerror()
 			self.currentenv = self.interpreter.current
+			# an interrupted execution tells nothing about the duration of a complete one
+			if not self.interpreter.cancelled:
+				self.execduration = 0.5*(self.execduration + self.interpreter.duration)
 			self.execthread = None
 			
 			@qtschedule
@@ -405,8 +445,28 @@ class Madcad(QObject):
 		self.execthread = Thread(target=job)
 		self.execthread.start()
 	
+	def update_capture(self):
+		''' execute again if the display zones contain statements that did not keep their temporary values 
+			it is only done when the script has not been modified since the last execution
+		'''
+		if (	settings.execution['temporaries'] != 'all'
+			and	not self.execthread
+			and	self.interpreter.ast_end >= len(self.interpreter.text)
+			and	self.interpreter.uncaptured(self.displayzones.values())
+			):
+			self.execute()
+	
+	def cancel_execution(self):
+		''' stop the running execution at its next statement, and wait for it '''
+		# the thread resets execthread when it ends
+		thread = self.execthread
+		if thread:
+			self.interpreter.cancel()
+			thread.join()
+	
 	def reexecute(self):
 		''' reexecute all the script '''
+		self.interpreter.forget()
 		self.interpreter.change(self.editzone[0], 0, '')
 		self.execute()
 		
@@ -457,9 +517,8 @@ class Madcad(QObject):
 			self.active_editor = next(iter(self.editors.values()), None)
 			
 	def _edit(self):
-		for disp in scene_unroll(self.active_sceneview.scene):
-			(	disp.selected 
-			and hasattr(disp, 'source') 
+		for disp in list(self.active_sceneview.scene.selection.values()):
+			(	hasattr(disp, 'source') 
 			and id(disp.source) in self.interpreter.ids 
 			and self.edit(self.interpreter.ids[id(disp.source)])
 			)
@@ -491,18 +550,18 @@ class Madcad(QObject):
 			scene.poses['return'] = scene.displays.get(callname)
 		
 		# setup the zone edition
-		newzone = [defnode.body[0].position-2, defnode.end_position]
+		newzone = [astinterval(defnode.body[0])[0]-2, astinterval(defnode)[1]]
 		self.scopes.append([
 						self.interpreter, 		# former it
 						self.editzone, 			# former editzone
 						newzone[1]-newzone[0], 	# initial size
 						self.exectarget,		# former target
 						callnode.func.id,		# callee name
-						callnode.end_position,	# cursor on call
+						astinterval(callnode)[1],	# cursor on call
 						])
 		self.editzone = newzone
 		self.interpreter = it
-		self.exectarget = defnode.end_position
+		self.exectarget = astinterval(defnode)[1]
 		self.execute()
 		
 		# set the cursor to the return statement
@@ -746,19 +805,22 @@ class Madcad(QObject):
 		pass
 		
 	def deselectall(self):
-		for disp in scene_unroll(self.active_sceneview.scene):
-			if disp.selected:	disp.selected = False
+		scene = self.active_sceneview.scene
+		for disp in scene.selection.values():
+			disp.selected = False
 			if type(disp).__name__ in ('SolidDisplay', 'WebDisplay'):
 				disp.vertices.flags &= 0b11111110
 				disp.vertices.flags_updated = True
-		self.active_sceneview.scene.active_selection = None
+		scene.selection.clear()
+		scene.selected = False
+		scene.active_selection = None
 		self.active_sceneview.update()
 		self.active_sceneview.update_active_selection()
 		self.updatescript()
 		
 	def set_active_solid(self):
-		found = next((disp	for disp in scene_unroll(self.active_sceneview.scene)
-							if isinstance(disp, Solid.display) and disp.selected), 
+		found = next((disp	for disp in self.active_sceneview.scene.selection.values()
+							if isinstance(disp, Solid.display)), 
 						None)
 		self.active_sceneview.scene.active_solid = found
 		self.active_sceneview.update()
@@ -855,16 +917,7 @@ class Madcad(QObject):
 		return name
 		
 	def posvar(self, position):
-		mscore = inf
-		mname = None
-		for name,node in self.interpreter.locations.items():
-			start,stop = astinterval(node)
-			if start <= position and position <= stop:
-				score = stop-start
-				if score < mscore:
-					mscore = score
-					mname = name
-		return mname
+		return self.interpreter.index.innermost(position)
 	
 	def updatescript(self):
 		zonehighlight = QColor(40, 200, 240, 60)
@@ -884,24 +937,24 @@ class Madcad(QObject):
 		# highlight view selections
 		if self.active_sceneview:
 			seen = set()
-			for obj in scene_unroll(self.active_sceneview.scene):
+			for obj in self.active_sceneview.scene.selection.values():
 				if not hasattr(obj, 'source'):	continue
 				i = id(obj.source)
-				if (obj.selected and obj.source 
+				if (obj.source 
 				and i not in seen 
 				and	i in it.ids
 				and it.ids[i] in it.locations):
 					seen.add(i)
-					zone = it.locations[it.ids[i]]
-					cursor.setPosition(zone.position)
-					cursor.setPosition(zone.end_position, QTextCursor.KeepAnchor)
+					start, end = astinterval(it.locations[it.ids[i]])
+					cursor.setPosition(start)
+					cursor.setPosition(end, QTextCursor.KeepAnchor)
 					extra.append(extraselection(cursor, charformat(background=selectionhighlight)))
 		
 		# highlight zones edited by a view editor
 		for edited in self.editors:
-			zone = it.locations[edited]
-			cursor.setPosition(zone.position)
-			cursor.setPosition(zone.end_position, QTextCursor.KeepAnchor)
+			start, end = astinterval(it.locations[edited])
+			cursor.setPosition(start)
+			cursor.setPosition(end, QTextCursor.KeepAnchor)
 			extra.append(extraselection(cursor, charformat(background=editionhighlight)))
 		
 		# highlight text edition zone
@@ -922,7 +975,7 @@ class Madcad(QObject):
 		i = astatpos(self.interpreter.part, self.exectarget)
 		if i < len(self.interpreter.part.body):
 			around = self.interpreter.part.body[i]
-			self.displayzones['aroundtarget'] = around.position, around.end_position
+			self.displayzones['aroundtarget'] = astinterval(around)
 		else:
 			self.displayzones.pop('aroundtarget', None)
 	
@@ -1207,7 +1260,8 @@ class ComputationProgress(QWidget):
 		
 		layout = QVBoxLayout()
 		
-		layout.addWidget(QLabel('computing ...'))
+		self.label = QLabel('computing ...')
+		layout.addWidget(self.label)
 		
 		self.bar = QProgressBar()
 		self.bar.setRange(0,100)
@@ -1215,9 +1269,28 @@ class ComputationProgress(QWidget):
 		layout.addWidget(self.bar)
 		
 		self.setLayout(layout)
+		self.state = None	# last state posted and not yet displayed
+		self.statelock = Lock()
 		
-	def set_state(self, rate):
+	def set_state(self, rate, line=None, elapsed=None):
 		self.bar.setValue(int(rate*100))
+		if line is None:
+			self.label.setText('computing ...')
+		else:
+			self.label.setText('computing line {} ...  {:.1f}s'.format(line, elapsed))
+	
+	def post(self, rate, line=None, elapsed=None):
+		''' set the state from an other thread, only the last state posted before the Qt thread handles it is displayed '''
+		with self.statelock:
+			scheduled = self.state is not None
+			self.state = (rate, line, elapsed)
+		if not scheduled:
+			qtschedule(self._poststate)
+	
+	def _poststate(self):
+		with self.statelock:
+			state, self.state = self.state, None
+		self.set_state(*state)
 		
 	def show(self):
 		if self.main.mainwindow and not self.parent():
@@ -1,16 +1,31 @@
-import ast, inspect
-from types import ModuleType
+import ast, inspect, pickle, sys, os, io, mmap, tempfile, weakref, hashlib, traceback
+import importlib.metadata
+import multiprocessing, threading, queue
+from concurrent import futures
+from multiprocessing import shared_memory
+from collections import ChainMap
+from types import ModuleType, FunctionType, BuiltinFunctionType, MethodType
 from copy import copy, deepcopy
 from time import time
+from difflib import SequenceMatcher
 from madcad.mathutils import bisect
+from bisect import bisect_left, bisect_right
 from madcad.nprint import nprint
 
 
 class InterpreterError(Exception):	pass
+class ExecutionCancelled(Exception):	pass
+class WorkerDied(Exception):	pass
 
 class Interpreter:
 	''' script interpreter using caching '''
 	backupstep = 0.2
+	workers = 0			# number of worker processes allowed to execute independent statements, 0 to execute everything in the current process
+	backupmemory = None	# memory budget for the backups in bytes, None for unlimited
+	spilldir = None		# directory where the backups exceeding the memory budget are written, None to drop them instead
+	capturezones = None	# text intervals of the statements which temporary values are kept, None to keep them in all statements
+	isolated = False	# execute the assignments calling functions in worker processes, so they do not hold the current process and can be interrupted; the other statements still run in the current process
+	progressrate = 20	# maximum number of progress reports per second
 
 	def __init__(self, text='', env=None, extract=None, name='custom-interpreter'):
 		self.name = name	# module name of the interpreter
@@ -24,51 +39,132 @@ class Interpreter:
 		self.current = env or {}		# current env (after last execution)
 		self.reused = set()
 		self.neverused = set()
-		self.ids = {}			# object names indexed by their id
+		self.ids = NameIndex()	# object names indexed by their id
+		self.indexed = None		# snapshot and names written since it, for the environment indexed in ids
 		self.locations = {}		# objects location intervals indexed by object name
+		self.index = LocationIndex(self.locations)	# locations sorted by text position
 		
-		self.backups = [(0, self.current)]						# local variables used
+		self.backups = [(0, Snapshot(None, self.current))]		# local variables used, as layers of the variables changed since the previous backup
 		self.ast = ast.Module(body=[], type_ignores=[])		# last complete ast compiled
 		self.ast_end = 0							# end position of the last ast in the text
+		self.tail = []			# statements after the last edition, to be put back in the ast once the text before them is parsed again
+		self.tailshift = (0, 0)	# text position and line offsets to apply to the statements in tail
+		
+		self.cache = {}			# statement results indexed by statement content and fingerprints of the variables read
+		self.flow = []			# results of the top-level statements in the last execution, used to schedule the next one
+		self.runs = 0			# number of executions, used to stamp the cache entries
+		self.stored = {}		# serialized results of statements from a former session, indexed by provenance signature
+		self.compiled = weakref.WeakKeyDictionary()	# processed and compiled code of the top-level statements, dropped with them
+		self.cancelled = False	# set to stop the running execution at the next statement
+		self.lock = threading.Lock()	# held while changing the backups, which a cancelled execution may still be doing
+		self.duration = 0		# time spent in the statements by the last execution, in seconds
+		self.changed = None		# names of the variables which value or usage may differ from the former execution, None if unknown
 	
 	def change(self, position, oldsize, newcontent):
-		''' change a part of the text, invalidating all backups and AST statements after position '''
-		self.text = self.text[:position] + newcontent + self.text[position+oldsize:]
+		''' change a part of the text, invalidating all backups and AST statements after position 
+			the statements after the edited lines are kept apart, and will be reused if the text before them is still parsing the same way
+		'''
+		old = self.text
+		self.text = old[:position] + newcontent + old[position+oldsize:]
 		
 		# get the position in the AST (the position of the line beginning, because change occuring on an existing line can change its semantic)
-		i = astatpos(self.ast, self.text.rfind('\n', 0, position)+1)
+		linestart = self.text.rfind('\n', 0, position)+1
+		i = astatpos(self.ast, linestart)
 		if i < len(self.ast.body):
-			self.ast_end = self.ast.body[i-1].end_position if i else 0
+			# the statements can only be kept if there is no text not parsed after them
+			if self.ast_end >= len(old):
+				self.tail = self.ast.body[i:]
+			else:
+				self.tail = []
+			self.tailshift = (0, 0)
+			# parsing will restart at the beginning of a line
+			self.ast_end = min(linestart, old.rfind('\n', 0, astinterval(self.ast.body[i])[0])+1)
+			if i:
+				self.ast_end = max(self.ast_end, astinterval(self.ast.body[i-1])[1])
 			self.ast.body[i:] = []
-			self.backups[self.lastbackup(self.ast_end)+1:] = []
+			# an obsolete execution may still be running, it must not insert its backups meanwhile
+			with self.lock:
+				self.backups[self.lastbackup(self.ast_end)+1:] = []
 		elif self.ast.body:
-			self.ast_end = self.ast.body[-1].end_position
+			self.ast_end = min(linestart, old.find('\n', astinterval(self.ast.body[-1])[1])+1 or len(old))
 		else:
 			self.ast_end = 0
 		
+		# only the statements starting after the edited lines are unchanged
+		lineend = old.find('\n', position+oldsize)
+		if lineend < 0:		lineend = len(old)
+		offset, lines = self.tailshift
+		k = 0
+		while k < len(self.tail) and astinterval(self.tail[k])[0] + offset <= lineend:
+			k += 1
+		del self.tail[:k]
+		self.tailshift = (
+			offset + len(newcontent) - oldsize, 
+			lines + newcontent.count('\n') - old.count('\n', position, position+oldsize),
+			)
+	
+	def shifttail(self):
+		''' apply the pending offsets to the statements in tail, only their anchors need to move '''
+		offset, lines = self.tailshift
+		if offset or lines:
+			for stmt in self.tail:
+				stmt.anchor.position += offset
+				stmt.anchor.lineno += lines
+		self.tailshift = (0, 0)
+		
 	def lastbackup(self, position):
 		''' get the index of the last env backup before position '''
 		i = bisect(self.backups, position, key=lambda backup: backup[0])
 		if i == len(self.backups) or self.backups[i][0] > position:	i -= 1
 		return i
 	
+	def cancel(self):
+		''' stop the running execution at the next top-level statement, it then raises ExecutionCancelled 
+			the backups already taken are kept, and the statements executed so far are reused by the next execution
+		'''
+		self.cancelled = True
+		# interrupt the statements running in worker processes
+		if _pool[1]:
+			_pool[1].kill()
+	
 	def execute(self, target=-1, autobackup=False, onstep=None):
-		''' execute the code from last backups to the target string position '''
+		''' execute the code from last backups to the target string position 
+			onstep(rate, line, elapsed) is called when starting top-level statements, at most progressrate times per second, with the rate of statements done, the line of the statement starting and the time elapsed since the execution start
+		'''
+		self.cancelled = False
 		if target < 0:	target += len(self.text)
 		self.target = target
 		
 		# rebuild AST to target
 		if target > self.ast_end:
-			part = self.text[self.ast_end:]
+			# parse only the text until the statements kept from the former AST
+			end = len(self.text)
+			if self.tail:
+				end = astinterval(self.tail[0])[0] + self.tailshift[0]
+				if self.text[end-1:end] not in ('\n', ''):
+					self.tail = []
+					end = len(self.text)
+			part = self.text[self.ast_end:end]
 			try:
 				addition = ast.parse(part, self.name)
 			except SyntaxError as err:
-				raise InterpreterError(err)
+				if not self.tail:
+					raise InterpreterError(err)
+				# the edition changed the meaning of the following statements, so parse them again
+				self.tail = []
+				part = self.text[self.ast_end:]
+				try:
+					addition = ast.parse(part, self.name)
+				except SyntaxError as err:
+					raise InterpreterError(err)
 			astannotate(addition, part)
 			endloc = textloc(self.text, self.ast_end)
-			astshift(addition, (endloc[0]-1, endloc[1]), self.ast_end)
+			astanchor(addition, self.ast_end, endloc[0]-1)
 			self.ast.body.extend(addition.body)
-			self.ast_end += len(part)
+			self.shifttail()
+			self.ast.body.extend(self.tail)
+			self.tail = []
+			self.ast_end = len(self.text)
 		
 		# get ast subnode if an extractor is defined
 		scope = self.extract(self.ast)
@@ -79,45 +175,164 @@ class Interpreter:
 		ast_current = astatpos(scope, backpos)
 		ast_target = astatpos(scope, target)
 		# ast until target
-		part = scope.body[ast_current:ast_target]
-		# pick possible backup points
-		stops = set(stmt.end_position  for stmt in part)
+		statements = scope.body[ast_current:ast_target]
+		provenance(scope.body[:ast_target])
 		# remaining expressions before target in the AST
+		remains = []
 		if ast_target < len(scope.body):
-			part += astexpruntil(scope.body[ast_target], target)
+			remains = astexpruntil(scope.body[ast_target], target)
 		
-		self.part = part = ast.Module(body=part, type_ignores=[])
-		processed, locations = self.process(part, backenv.keys())
-		env = copy(backenv)
+		self.part = part = ast.Module(body=statements+remains, type_ignores=[])
+		base = backenv
+		env = backenv.flatten()
+		touched = None	# names written since the base snapshot, None if unknown
 		
 		error = None
 		if autobackup:
+			self.runs += 1
+			executed = []	# text intervals of the statements actually executed
+			pending = []	# statements being executed by worker processes
+			failed = None	# statement which execution failed in a worker
 			
-			starttime = time()
-			for i, stmt in enumerate(processed.body):
-				code = compile(ast.Module(
-									body=[stmt], 
-									type_ignores=[]), 
-								self.name, 
-								'exec')
-				
-				# execute the code
-				try:
-					exec(code, env)
-				except Exception as err:
-					error = err
+			# schedule the statements: only those reading variables changed since the former execution are executed, the others reuse their former result
+			former = self.flow[ast_current:]
+			matches = flowmatch(former, statements)
+			stale = flowstale(former, matches, statements)	# matched records to execute again anyway
+			flow = self.flow[:ast_current]
+			consumed = 0
+			tainted = set()		# variables whose value differs from the former execution
+			written = set()		# variables written since the last backup
+			processed = []		# processed statements not recorded in the flow
+			locations = {}
+			
+			starttime = duration = time()
+			reported = 0
+			for i, stmt in enumerate(part.body):
+				if self.cancelled:
+					error = ExecutionCancelled()
 					break
-					
-				if onstep:
-					onstep(i/len(processed.body))
+				if onstep and time() - reported >= 1/self.progressrate:
+					reported = time()
+					onstep(i/len(part.body), stmt.anchor.lineno, reported - duration)
+				record = None
+				if i < len(statements) and matches[i] is not None:
+					# variables written by dropped statements may now have an other value
+					for dropped in former[consumed:matches[i]]:
+						tainted.update(dropped.writes)
+					consumed = matches[i]+1
+					record = former[matches[i]]
 				
-				# autobackup if this is between 2 statements
-				if stmt.end_position in stops and time() - starttime > self.backupstep:
-					self.backups[self.lastbackup(stmt.position)+1
-								:self.lastbackup(target)+1] = [(stmt.end_position, copy(env))]
+				# calls to the script functions also read the globals these functions use
+				reads, writes = stmtflow(stmt)
+				if record and matches[i] not in stale and tainted.isdisjoint(reads):
+					failed = self._join(pending, record.writes, env, flow, tainted)
+					if failed:	break
+					if not record.captured and not record.modifies and self.capturing(stmt):
+						self._recapture(stmt, record, env)
+					record.restore(env)
+					record.moveto(stmt)
+					tainted.difference_update(record.writes)
+					written.update(record.writes)
+				else:
+					executed.append(astinterval(stmt))
+					job = None
+					new = None
+					# reuse the result stored by a former session if the statement and its dependencies did not change
+					if i < len(statements) and stmt.signature in self.stored:
+						failed = self._join(pending, None if '*' in writes else reads | writes, env, flow, tainted)
+						if failed:	break
+						new = self._revive(stmt, env)
+					# independent statements can run concurrently in worker processes
+					if not new and (self.workers or self.isolated) and i < len(statements) and remotable(stmt, env):
+						failed = self._join(pending, reads | writes, env, flow, tainted)
+						if failed:	break
+						job = self._dispatch(stmt, record, env, pending)
+					if job:
+						job.index = len(flow)
+						pending.append(job)
+						tainted.update(job.writes)
+						written.update(job.writes)
+						record = None
+					else:
+						if not new:
+							failed = self._join(pending, None if '*' in writes else reads | writes, env, flow, tainted)
+							if failed:	break
+							before = copy(env) if '*' in writes else None
+							body, known, error = self._execute(stmt, env)
+							if i >= len(statements) or error:
+								processed.extend(body)
+								locations.update(known)
+								if error:	break
+								else:		continue
+							new = FlowRecord(stmt, body, known, env, before, self.capturing(stmt))
+						changes = new.changes(record)
+						tainted.difference_update(new.writes)
+						tainted.update(changes)
+						written.update(new.writes)
+						record = new
+				
+				flow.append(record)
+				
+				# autobackup if this is between 2 statements and all the former statements are complete
+				if not pending and time() - starttime > self.backupstep:
+					backenv = Snapshot(backenv, env, written, time() - starttime)
+					start, end = astinterval(stmt)
+					# the text may have changed since the execution was cancelled
+					with self.lock:
+						if not self.cancelled:
+							self.backups[self.lastbackup(start)+1
+										:self.lastbackup(target)+1] = [(end, backenv)]
+							self.bound()
+					written = set()
 					starttime = time()
+			
+			# wait for the statements still running
+			failed = failed or self._join(pending, None, env, flow, tainted)
+			self.duration = time() - duration
+			if failed:
+				processed = list(failed.body)
+				locations = dict(failed.known)
+				error = failed.error
+			known = {}
+			for record in flow[ast_current:]:
+				known.update(record.locations)
+			known.update(locations)
+			locations = known
+			# exec inserts the builtins in the environment it is given
+			touched = {'__builtins__', *locations}
+			for record in flow[ast_current:]:
+				touched.update(record.writes)
+			if error and not failed:
+				touched.update(stmtflow(stmt)[1])
+			if '*' in touched:
+				touched = None
+			processed = ast.Module(body=[sub	for record in flow[ast_current:]	for sub in record.processed] + processed, type_ignores=[])
+			# keep the records not reached for the next executions, unless they depend on variables that changed or produce results modified by the records dropped
+			trailing = former[consumed:]
+			dropped = set()
+			while True:
+				outdated = set(tainted)
+				producers = {}	# index of the last record writing each variable
+				invalid = set()
+				for k, record in enumerate(trailing):
+					if k in dropped or not outdated.isdisjoint(record.reads):
+						dropped.add(k)
+						outdated.update(record.writes)
+						invalid.update(producers[name]	for name in record.modifies	if name in producers)
+					for name in record.writes:
+						producers[name] = k
+				if invalid <= dropped:	break
+				dropped |= invalid
+			flow.extend(record	for k, record in enumerate(trailing)	if k not in dropped)
+			self.flow = flow
+			
+			# drop the results of statements that were executed but have not been reused
+			for key, result in list(self.cache.items()):
+				if result.run != self.runs and any(start <= result.position < stop	for start, stop in executed):
+					del self.cache[key]
 				
 		else:
+			processed, locations = self.process(part, backenv)
 			code = compile(processed, self.name, 'exec')
 			
 			# execute the code
@@ -134,34 +349,322 @@ class Interpreter:
 			if name not in locations and name in env:
 				locations[name] = obj
 		self.locations = locations
-		self.ids = {id(obj): name	for name,obj in env.items()}
+		self.index = LocationIndex(locations)
+		changed = self.reindex(base, touched)
 		
 		used, reused = varusage(part)
 		self.used = used
 		self.neverused |= used
 		self.neverused -= reused
+		# the usage of a variable changes whether it is displayed
+		if changed is not None:
+			changed |= used | reused
+		self.changed = changed
 		
+		# a cancelled execution is obsolete even if it reached its target
+		if isinstance(error, ExecutionCancelled) or self.cancelled:
+			raise ExecutionCancelled()
 		if error:	
 			raise InterpreterError(error)
 	
-	def process(self, tree, oldvars):
+	def _execute(self, stmt, env):
+		''' process and execute a top-level statement in the given env, reusing cached results of its substatements 
+			return the processed statements, the variables it defined, and the error that interrupted it if any
+		'''
+		processed, known, codes = self._compile(stmt, env)
+		# the cached results holding the objects modified by the statement are no longer valid
+		modified = stmtmodifies(stmt, varflow(stmt)[0])
+		if modified:
+			self._uncache(modified, env)
+		# the substatements of other statements may modify the objects they read, only those of assignments are cached
+		assignment = isinstance(stmt, (ast.Assign, ast.AnnAssign))
+		for sub, code in zip(processed, codes):
+			# reuse the statement result if its inputs didn't change since it was computed
+			key = cachekey(sub, env) if assignment and cacheable(sub) else None
+			result = self.cache.get(key)
+			if result:
+				env.update(result.outputs)
+				result.position = astinterval(sub)[0]
+				result.run = self.runs
+				continue
+			
+			# execute the code
+			try:
+				exec(code, env)
+			except Exception as err:
+				return processed, known, err
+			
+			if key:
+				self.cache[key] = StatementResult(sub, env, self.runs)
+		return processed, known, None
+	
+	def _uncache(self, names, env):
+		''' drop the cached results which outputs are objects of the given variables '''
+		objects = {id(env[name])	for name in names	if name in env}
+		for key, result in list(self.cache.items()):
+			if any(id(value) in objects	for value in result.outputs.values()):
+				del self.cache[key]
+	
+	def _compile(self, stmt, env):
+		''' process and compile a top-level statement, or reuse the result of its former compilation if its temporary names are still free in env
+			return the processed statements, the variables it defined, and the code of each processed statement
+		'''
+		keep = self.capturing(stmt)
+		lineno = stmt.anchor.lineno
+		compiled = self.compiled.get(stmt)
+		if compiled:
+			probes, kept, processed, known, codes, former = compiled
+			# the processed statements may have been moved to an other statement with the same code
+			if (	kept == keep 
+				and	processed[-1].anchor is stmt.anchor
+				and	all((name in env) == present	for name, present in probes)
+				):
+				if former != lineno:
+					for sub in processed:
+						astlines(sub, lineno - former)
+					codes = [compile(ast.Module(body=[sub], type_ignores=[]), self.name, 'exec')
+								for sub in processed]
+					self.compiled[stmt] = probes, kept, processed, known, codes, lineno
+				return processed, known, codes
+		
+		probes = []
+		processed, known = self.process(ast.Module(body=[stmt], type_ignores=[]), env, probes)
+		codes = [compile(ast.Module(body=[sub], type_ignores=[]), self.name, 'exec')
+					for sub in processed.body]
+		self.compiled[stmt] = probes, keep, processed.body, known, codes, lineno
+		return processed.body, known, codes
+	
+	def _dispatch(self, stmt, record, env, pending):
+		''' start the execution of a top-level statement in a worker process, with only the variables it reads
+			return the RemoteJob, or None if the statement cannot be shipped and must be executed locally
+		'''
+		# temporary names must not collide with the ones of the statements still running
+		processed, known = self.process(ast.Module(body=[stmt], type_ignores=[]), ChainMap(env, *(job.known	for job in pending)))
+		reads, writes = varflow(stmt)
+		writes.update(known)
+		inputs = {name: env[name]	for name in reads	if name in env}
+		try:
+			data = pickle.dumps((processed.body, inputs, writes))
+		except Exception:
+			return None
+		future = executor(max(1, self.workers)).submit(remote_execute, self.name, data)
+		return RemoteJob(stmt, record, processed.body, known, inputs, writes, future)
+	
+	def _join(self, pending, names, env, flow, tainted):
+		''' wait for the pending statements writing any of the given names (all of them if names is None) and put their results in env 
+			return the job that failed if any, the pending jobs and the flow after it are then dropped
+		'''
+		for job in list(pending):
+			if names is not None and names.isdisjoint(job.writes):
+				continue
+			pending.remove(job)
+			# the statements still running are abandoned if the execution is cancelled
+			while not job.future.done() and not self.cancelled:
+				futures.wait([job.future], timeout=0.05)
+			if self.cancelled:
+				job.error = ExecutionCancelled()
+			else:
+				try:
+					outputs = job.future.result()
+				except Exception as err:
+					outputs = None
+					# an isolated execution must not run the statement in the current process, unless its result could not be transfered
+					if self.isolated and not isinstance(err, pickle.PickleError):
+						job.error = err
+				# the worker was not able to compute or return it, so execute it here to get its result or its error
+				if outputs is None and not job.error:
+					local = copy(env)
+					local.update(job.inputs)
+					try:
+						exec(compile(ast.Module(body=job.body, type_ignores=[]), self.name, 'exec'), local)
+					except Exception as err:
+						job.error = err
+					else:
+						outputs = {name: local[name]	for name in job.writes	if name in local}
+			if job.error:
+				for other in pending:
+					other.future.cancel()
+				pending.clear()
+				del flow[job.index:]
+				return job
+			env.update(outputs)
+			new = FlowRecord(job.stmt, job.body, job.known, outputs, captured=self.capturing(job.stmt))
+			changes = new.changes(job.record)
+			tainted.difference_update(new.writes)
+			tainted.update(changes)
+			flow[job.index] = new
+	
+	def _recapture(self, stmt, record, env):
+		''' execute again a statement which result is known, to get the temporary values it did not keep 
+			the variables it writes keep their former values, so that the statements depending on them are not affected
+			statements modifying their inputs cannot be executed again this way, their temporary values will only be kept at their next execution
+		'''
+		local = copy(env)
+		body, known, error = self._execute(stmt, local)
+		if error:	return
+		temporaries = {name: local[name]	for name in known	if name not in record.writes and name in local}
+		record.outputs.update(temporaries)
+		record.writes.update(temporaries)
+		record.processed = body
+		record.locations = known
+		record.anchor = stmt.anchor
+		record.captured = True
+	
+	def capturing(self, stmt):
+		''' return True if the temporary values of the given statement are to be kept '''
+		if self.capturezones is None:	return True
+		start, end = astinterval(stmt)
+		return any(zs <= end and start <= ze	for zs, ze in self.capturezones)
+	
+	def uncaptured(self, zones):
+		''' return True if some statements executed until the target in the given zones did not keep their temporary values '''
+		for record in self.flow:
+			if not record.captured and not record.modifies:
+				start, end = astinterval(record.processed[-1])
+				if end <= self.target and any(zs <= end and start <= ze	for zs, ze in zones):
+					return True
+		return False
+	
+	def _revive(self, stmt, env):
+		''' put in env the results of a top-level statement stored by a former session 
+			return its FlowRecord or None if the stored results cannot be used
+		'''
+		try:
+			outputs, removed = pickle.loads(self.stored[stmt.signature])
+		except Exception:
+			return None
+		processed, known = self.process(ast.Module(body=[stmt], type_ignores=[]), env)
+		# the temporary values must be present to be displayed
+		if not outputs.keys() >= known.keys():
+			return None
+		reads, writes = stmtflow(stmt)
+		before = copy(env) if '*' in writes else None
+		# the temporary values are not kept outside the capture zones, the variables modified in place are stored with the statement
+		if '*' not in writes:
+			modified = stmtmodifies(stmt, reads)
+			outputs = {name: value	for name, value in outputs.items()	if name in writes or name in known or name in modified}
+		for name in removed:
+			env.pop(name, None)
+		env.update(outputs)
+		return FlowRecord(stmt, processed.body, known, env, before, self.capturing(stmt))
+	
+	def savecache(self, filename):
+		''' write the results of the last execution to a file, so that a next session can reuse them 
+			a variable is stored with the last statement modifying it, since it may be modified in place after its assignment
+		'''
+		last = {}
+		for record in self.flow:
+			for name in record.writes:
+				last[name] = record
+			for name in record.modifies:
+				if not shared(self.current.get(name)):
+					last[name] = record
+		entries = {}
+		for record in self.flow:
+			if not record.signature:	continue
+			# a statement can only be skipped if all the variables it writes can be restored
+			if any(last[name] is not record	for name in record.writes):	continue
+			data = self.stored.get(record.signature)
+			if data is None:
+				names = [name	for name in record.writes | record.modifies	if last.get(name) is record]
+				try:	data = pickle.dumps((
+								{name: self.current[name]	for name in names	if name in self.current}, 
+								[name	for name in names	if name not in self.current],
+								), protocol=5)
+				except Exception:	continue
+			entries[record.signature] = data
+		os.makedirs(os.path.dirname(filename), exist_ok=True)
+		with open(filename, 'wb') as file:
+			pickle.dump({'version': madcadversion(), 'entries': entries}, file, protocol=5)
+	
+	def loadcache(self, filename):
+		''' load the results written by a former session, they are used only if computed with the same madcad version '''
+		self.stored = {}
+		try:
+			with open(filename, 'rb') as file:
+				content = pickle.load(file)
+		except Exception:
+			return
+		if content.get('version') == madcadversion():
+			self.stored = content['entries']
+	
+	def bound(self):
+		''' evict backups until they fit in the memory budget, the ones cheap to recompute for their size first 
+			an evicted backup is spilled to disk if possible, else it is merged into the next one so that later backups stay complete
+		'''
+		if self.backupmemory is None:	return
+		total = sum(env.size	for pos, env in self.backups)
+		while total > self.backupmemory:
+			# the first backup is the initial environment and cannot be recomputed, the last one is the base of the next backups
+			# the spilled backups only keep in memory what cannot be written
+			candidates = [i	for i in range(1, len(self.backups)-1)	
+							if self.backups[i][1].size and self.backups[i][1].file is None]
+			if not candidates:	break
+			i = min(candidates, key=lambda i: self.backups[i][1].cost / self.backups[i][1].size)
+			if self.spilldir:
+				backup = self.backups[i][1]
+				size = backup.size
+				if backup.spill(self.spilldir):
+					total -= size - backup.size
+					continue
+			evicted = self.backups.pop(i)[1]
+			total -= evicted.size
+			if self.backups[i][1].parent is evicted:
+				child = self.backups[i][1]
+				total -= child.size
+				child.merge()
+				total += child.size
+	
+	def reindex(self, base, touched):
+		''' update the names index for the variables that may differ from the last environment indexed 
+			base is the snapshot the current environment was computed from, and touched the names written since, or None if unknown
+			return these variable names, or None if unknown
+		'''
+		former = self.indexed
+		self.indexed = base, touched
+		names = None
+		if former and former[1] is not None and touched is not None:
+			names = base.since(former[0])
+		if names is None:
+			self.ids.update(self.current)
+			return None
+		names |= touched | former[1]
+		self.ids.update(self.current, names)
+		return names
+	
+	def forget(self):
+		''' drop all the results kept from former executions, so that the next execution will run every statement again '''
+		self.cache.clear()
+		self.flow.clear()
+		self.stored.clear()
+	
+	def process(self, tree, oldvars, probes=None):
 		''' process an AST to retreive its temporary values 
 			the returned AST can be executed, but doesn't represent anymore the last code, it represents the new code, doing exactly the same thing, but keeping temporary values in additional variables
+			if probes is a list, the names looked for in oldvars are appended to it, with whether they were present
 		'''
 		tree = deepcopy(tree)
 		knownvars = {}
+		# the executed code must report the line numbers in the whole text
+		for statement in tree.body:
+			astlines(statement, statement.anchor.lineno-1)
 		
 		def tempname():
 			i = 0
 			while True:
 				i += 1
 				name = 'temp'+str(i)
-				if name not in knownvars and name not in oldvars:	return name
+				if name in knownvars:	continue
+				present = name in oldvars
+				if probes is not None:	probes.append((name, present))
+				if not present:	return name
 		
 		i = 0
 		while i < len(tree.body):
 			statement = tree.body[i]
 			begin = []
+			# statements outside the capture zones only retreive their assigned names
+			keep = self.capturing(statement)
 			
 			if isinstance(statement, ast.Return):
 				statement = tree.body[i] = ast.Assign(
@@ -174,8 +677,9 @@ class Interpreter:
 										statement.value,
 										lineno=statement.lineno,
 										col_offset=statement.col_offset,
-										position=statement.position,
-										end_position=statement.end_position,
+										anchor=statement.anchor,
+										offset=statement.offset,
+										end_offset=statement.end_offset,
 										)
 			
 			# recursive replacement procedure
@@ -189,12 +693,14 @@ class Interpreter:
 				elif isinstance(node, (ast.FunctionDef, ast.ClassDef)):
 					knownvars[node.name] = node
 				# capture expressions
+				elif not keep:
+					return
 				elif isinstance(node, (ast.BoolOp, ast.BinOp, ast.Call, ast.Tuple, ast.List)):
 					# capture sub expressions only if there is no controlflow structure at our level
 					if isinstance(node, (ast.BinOp, ast.Call, ast.Tuple, ast.List)):
 						astpropagate(node, capture)
 					
-					psts = {'lineno':node.lineno, 'col_offset':node.col_offset, 'position':node.position, 'end_position':node.end_position}
+					psts = {'lineno':node.lineno, 'col_offset':node.col_offset, 'anchor':node.anchor, 'offset':node.offset, 'end_offset':node.end_offset}
 					name = tempname()
 					knownvars[name] = node
 					begin.append(ast.Assign(
@@ -242,9 +748,10 @@ class Interpreter:
 				and	isinstance(node.func, ast.Name) 
 				and	node.func.id in self.locations
 				):
-				if node.position <= position and position <= node.end_position and (	
+				start, end = astinterval(node)
+				if start <= position and position <= end and (	
 						not callnode
-					or	callnode.position <= node.position and node.end_position <= callnode.position
+					or	astinterval(callnode)[0] <= start and end <= astinterval(callnode)[0]
 					):
 					callnode = node
 		# return if no matching function node under cursor
@@ -256,7 +763,7 @@ class Interpreter:
 		defnode = self.locations[funcname]
 		
 		# create the start state for the function scope
-		self.execute(callnode.position)
+		self.execute(astinterval(callnode)[0])
 		env = copy(self.current)
 		
 		# pass arguments to a replacement function
@@ -292,10 +799,751 @@ class Interpreter:
 					extract=extract,
 					)
 		it.locations = copy(self.locations)
+		it.index = self.index
 		it.ast = self.ast
 		return it, callnode, defnode
 
 
+class Snapshot:
+	''' frozen state of an environment, stored as the variables changed since a parent snapshot 
+		successive backups share the storage of their common variables
+	'''
+	__slots__ = 'parent', '_changes', 'cost', 'size', 'file', '__weakref__'
+	
+	def __init__(self, parent, env, names=None, cost=0.):
+		self.parent = parent
+		if names is None:
+			self._changes = dict(env)
+		else:
+			self._changes = {name: env.get(name, deleted)	for name in names}
+		self.cost = cost	# execution time from the parent snapshot to this one
+		self.size = approxsize(self._changes)	# memory used by the variables, 0 when they are stored on disk
+		self.file = None	# file the variables were spilled to, with the intervals of their buffers
+	
+	@property
+	def changes(self):
+		''' variables changed since the parent snapshot, loaded back from disk if spilled '''
+		if self._changes is None:
+			path, spans, references, resident = self.file
+			buffers = []
+			if spans:
+				with open(path+'.raw', 'rb') as raw:
+					# private mapping: objects modified after loading do not alter the file
+					data = memoryview(mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_COPY))
+				buffers = [data[start:stop]	for start, stop in spans]
+			with open(path, 'rb') as file:
+				unpickler = pickle.Unpickler(file, buffers=buffers)
+				unpickler.persistent_load = references.__getitem__
+				self._changes = unpickler.load()
+			self._changes.update(resident)
+		return self._changes
+	
+	def spill(self, directory):
+		''' write the variables to a file in the given directory, the array buffers are stored raw to be memory-mapped back when needed 
+			variables that cannot be serialized are kept in memory
+			return False if nothing could be written
+		'''
+		changes = self.changes
+		resident = {}
+		while True:
+			buffers = []
+			references = []
+			try:
+				data = spilldump(changes, buffers, references)
+				break
+			except Exception:
+				if resident:	return False
+			# find the variables that cannot be serialized
+			for name, value in changes.items():
+				try:	spilldump(value, [], [])
+				except Exception:	resident[name] = value
+			changes = {name: value	for name, value in changes.items()	if name not in resident}
+		if not buffers:
+			return False
+		
+		os.makedirs(directory, exist_ok=True)
+		fd, path = tempfile.mkstemp(prefix='backup-', dir=directory)
+		with open(fd, 'wb') as file:
+			file.write(data)
+		buffers = [buffer.raw()	for buffer in buffers]
+		spans = bufferspans(buffers)
+		with open(path+'.raw', 'wb') as raw:
+			for buffer, (start, stop) in zip(buffers, spans):
+				raw.write(bytes(start - raw.tell()))
+				raw.write(buffer)
+		weakref.finalize(self, removefiles, path, path+'.raw')
+		self.file = path, spans, references, resident
+		self._changes = None
+		self.size = approxsize(resident)
+		return True
+	
+	def merge(self):
+		''' merge the parent snapshot into this one, so that it doesn't need it anymore '''
+		parent = self.parent
+		changes = dict(parent.changes)
+		changes.update(self.changes)
+		self._changes = changes
+		self.parent = parent.parent
+		self.cost += parent.cost
+		self.size = approxsize(self.changes)
+		self.file = None
+	
+	def layers(self):
+		''' snapshots from the root one to this one '''
+		layers = []
+		layer = self
+		while layer is not None:
+			layers.append(layer)
+			layer = layer.parent
+		layers.reverse()
+		return layers
+	
+	def flatten(self):
+		''' return a new dictionnary with the content of the snapshot '''
+		env = {}
+		for layer in self.layers():
+			env.update(layer.changes)
+		for name in [name	for name, value in env.items()	if value is deleted]:
+			del env[name]
+		return env
+	
+	def __getitem__(self, name):
+		layer = self
+		while layer is not None:
+			if name in layer.changes:
+				value = layer.changes[name]
+				if value is deleted:	break
+				return value
+			layer = layer.parent
+		raise KeyError(name)
+	
+	def __setitem__(self, name, value):
+		self.changes[name] = value
+	
+	def __contains__(self, name):
+		try:	self[name]
+		except KeyError:	return False
+		else:	return True
+	
+	def get(self, name, default=None):
+		try:	return self[name]
+		except KeyError:	return default
+	
+	def keys(self):
+		return self.flatten().keys()
+	
+	def since(self, other):
+		''' names of the variables that may differ between this snapshot and an other one, None if they have no common parent '''
+		mine = self.layers()
+		common = {id(layer)	for layer in mine}
+		names = set()
+		layer = other
+		while layer is not None and id(layer) not in common:
+			names.update(layer.changes)
+			layer = layer.parent
+		if layer is None:
+			return None
+		for own in reversed(mine):
+			if own is layer:	break
+			names.update(own.changes)
+		return names
+
+class Deleted:
+	''' marker of a variable removed since the parent snapshot '''
+	def __reduce__(self):
+		return 'deleted'
+	def __repr__(self):
+		return 'deleted'
+
+deleted = Deleted()
+
+def spilldump(obj, buffers, references):
+	''' serialize an object, putting its buffers in the given list and keeping references to the modules, classes and functions in the references list '''
+	file = io.BytesIO()
+	pickler = pickle.Pickler(file, protocol=5, buffer_callback=buffers.append)
+	def persistent_id(obj):
+		if shared(obj):
+			references.append(obj)
+			return len(references)-1
+	pickler.persistent_id = persistent_id
+	pickler.dump(obj)
+	return file.getvalue()
+
+def shared(obj):
+	''' return True for the objects that belong to the program rather than to the script data: modules, classes and functions '''
+	return isinstance(obj, (ModuleType, type, FunctionType, BuiltinFunctionType, MethodType))
+
+def removefiles(*paths):
+	''' remove the given files if they still exist '''
+	for path in paths:
+		try:	os.remove(path)
+		except OSError:	pass
+
+def approxsize(obj, seen=None):
+	''' approximate memory footprint of an object in bytes, including the buffers of the arrays and meshes it refers to 
+		modules, classes and functions are considered shared with the rest of the program
+	'''
+	if seen is None:	seen = set()
+	if id(obj) in seen or shared(obj):
+		return 0
+	seen.add(id(obj))
+	# buffers: typedlists, numpy arrays, bytes
+	try:	
+		return memoryview(obj).nbytes
+	except TypeError:	
+		pass
+	size = sys.getsizeof(obj)
+	if isinstance(obj, dict):
+		size += sum(approxsize(key, seen) + approxsize(value, seen)	for key, value in obj.items())
+	elif isinstance(obj, (list, tuple, set, frozenset)):
+		size += sum(approxsize(item, seen)	for item in obj)
+	else:
+		if hasattr(obj, '__dict__'):
+			size += approxsize(vars(obj), seen)
+		for cls in type(obj).__mro__:
+			for slot in getattr(cls, '__slots__', ()):
+				if slot != '__dict__' and hasattr(obj, slot):
+					size += approxsize(getattr(obj, slot), seen)
+	return size
+
+class LocationIndex:
+	''' text intervals of the objects locations, sorted by start position to be searched by bisection 
+		the intervals are those at the time the index is built
+	'''
+	__slots__ = 'starts', 'entries', 'reach'
+	def __init__(self, locations):
+		# the locations mostly come in text order, so sorting them is almost linear
+		self.entries = sorted((astinterval(node) + (name,)	for name, node in locations.items()), key=lambda entry: entry[0])
+		self.starts = [start	for start, stop, name in self.entries]
+		# furthest end of the intervals starting before each entry, to know when to stop searching backward
+		self.reach = []
+		reach = -1
+		for start, stop, name in self.entries:
+			reach = max(reach, stop)
+			self.reach.append(reach)
+	
+	def __len__(self):
+		return len(self.entries)
+	
+	def containing(self, position):
+		''' yield the intervals (start, stop, name) containing the given position '''
+		i = bisect_right(self.starts, position)-1
+		while i >= 0 and self.reach[i] >= position:
+			if self.entries[i][1] >= position:
+				yield self.entries[i]
+			i -= 1
+	
+	def innermost(self, position):
+		''' name of the smallest interval containing the given position, or None '''
+		best = min(self.containing(position), key=lambda entry: entry[1]-entry[0], default=None)
+		return best[2] if best else None
+	
+	def overlap(self, start, stop):
+		''' yield the intervals having at least a point in the given range '''
+		i = bisect_left(self.starts, start)-1
+		# intervals starting before the range
+		before = []
+		while i >= 0 and self.reach[i] >= start:
+			if self.entries[i][1] >= start:
+				before.append(self.entries[i])
+			i -= 1
+		yield from reversed(before)
+		# intervals starting in the range
+		i = bisect_left(self.starts, start)
+		while i < len(self.entries) and self.starts[i] <= stop:
+			yield self.entries[i]
+			i += 1
+	
+	def inside(self, start, stop):
+		''' yield the intervals entirely in the given range '''
+		i = bisect_left(self.starts, start)
+		while i < len(self.entries) and self.starts[i] <= stop:
+			if self.entries[i][1] <= stop:
+				yield self.entries[i]
+			i += 1
+
+class NameIndex:
+	''' names of the objects of an environment, indexed by the objects ids 
+		it is updated only for the names that changed, an object can have multiple names
+	'''
+	__slots__ = 'objects', 'names'
+	def __init__(self, env=None):
+		self.objects = {}	# names of each object, indexed by its id, the last bound first
+		self.names = {}		# id of the object of each name
+		if env is not None:
+			self.update(env)
+	
+	def update(self, env, names=None):
+		''' reindex the given names of the environment, or all of them if names is None '''
+		if names is None:
+			self.objects.clear()
+			self.names.clear()
+			names = env.keys()
+		for name in names:
+			former = self.names.pop(name, None)
+			if former is not None:
+				bound = self.objects[former]
+				bound.remove(name)
+				if not bound:	del self.objects[former]
+			if name in env:
+				key = id(env[name])
+				self.names[name] = key
+				self.objects.setdefault(key, []).insert(0, name)
+	
+	def __contains__(self, key):
+		return key in self.objects
+	
+	def __getitem__(self, key):
+		return self.objects[key][0]
+	
+	def get(self, key, default=None):
+		bound = self.objects.get(key)
+		return bound[0] if bound else default
+	
+	def all(self, key):
+		''' all the names of the object with the given id '''
+		return list(self.objects.get(key, ()))
+	
+	def __len__(self):
+		return len(self.objects)
+
+class StatementResult:
+	''' variables written by a cached statement, with the variables it read to keep their identities alive '''
+	__slots__ = 'inputs', 'outputs', 'position', 'run'
+	def __init__(self, stmt, env, run):
+		reads, writes = varflow(stmt)
+		self.inputs = [env.get(name)	for name in sorted(reads)]
+		self.outputs = {name: env[name]	for name in writes if name in env}
+		self.position = astinterval(stmt)[0]
+		self.run = run
+
+class FlowRecord:
+	''' result of the execution of a top-level statement, with the variables it reads and writes '''
+	__slots__ = 'key', 'signature', 'anchor', 'reads', 'modifies', 'writes', 'outputs', 'processed', 'locations', 'captured'
+	def __init__(self, stmt, processed, locations, env, before=None, captured=True):
+		reads, writes = stmtflow(stmt)
+		writes.discard('*')
+		writes.update(locations)
+		# a star import writes variables that are only known after execution
+		if before is not None:
+			writes.update(name	for name in env	if before.get(name, env) is not env[name])
+		self.key = astkey(stmt)
+		self.signature = getattr(stmt, 'signature', None)
+		self.anchor = stmt.anchor
+		self.reads = reads
+		self.modifies = stmtmodifies(stmt, reads)
+		self.writes = writes
+		self.outputs = {name: env[name]	for name in writes	if name in env}
+		self.processed = processed
+		self.locations = locations
+		# only assignments and expressions have temporary values
+		self.captured = captured or not isinstance(stmt, (ast.Assign, ast.Expr))
+	
+	def restore(self, env):
+		''' put the statement results in env as if it was executed '''
+		for name in self.writes:
+			if name in self.outputs:	env[name] = self.outputs[name]
+			else:						env.pop(name, None)
+	
+	def moveto(self, stmt):
+		''' place the processed statements at the position of the given statement, having the same code '''
+		if stmt.anchor is not self.anchor:
+			for sub in self.processed:
+				for node in ast.walk(sub):
+					if getattr(node, 'anchor', None) is self.anchor:
+						node.anchor = stmt.anchor
+			self.anchor = stmt.anchor
+	
+	def changes(self, former):
+		''' variables which values differ from the former result of the same statement '''
+		if not former:	
+			return set(self.writes)
+		return {name	for name in self.writes | former.writes
+					if name not in self.outputs or name not in former.outputs
+					or fingerprint(self.outputs[name]) != fingerprint(former.outputs[name])}
+
+class RemoteJob:
+	''' top-level statement being executed in a worker process '''
+	__slots__ = 'index', 'stmt', 'record', 'body', 'known', 'inputs', 'writes', 'future', 'error'
+	def __init__(self, stmt, record, body, known, inputs, writes, future):
+		self.index = None		# index of the statement in the execution flow
+		self.stmt = stmt
+		self.record = record	# former result of the statement
+		self.body = body		# processed statements sent
+		self.known = known
+		self.inputs = inputs
+		self.writes = writes
+		self.future = future
+		self.error = None
+
+def remotable(stmt, env):
+	''' return True if the statement is an assignment involving a function call, which can be worth sending to a worker process 
+		method calls on variables may modify them, which would only happen to their copies in the worker
+	'''
+	if not isinstance(stmt, ast.Assign) or stmtmodifies(stmt, ()):
+		return False
+	calls = [node	for node in ast.walk(stmt.value)	if isinstance(node, ast.Call)]
+	for call in calls:
+		owner = call.func
+		while isinstance(owner, (ast.Attribute, ast.Subscript)):
+			owner = owner.value
+		if (	owner is not call.func and isinstance(owner, ast.Name) 
+			and	not isinstance(env.get(owner.id), (ModuleType, type))):
+			return False
+	return bool(calls)
+
+def remote_execute(name, data):
+	''' execute statements in a worker process, return the variables written 
+		an exception raised by the statements is sent back with the text of its traceback in its attribute remotetraceback
+	'''
+	body, inputs, writes = pickle.loads(data)
+	env = dict(inputs)
+	try:
+		exec(compile(ast.Module(body=body, type_ignores=[]), name, 'exec'), env)
+	except Exception as err:
+		err.remotetraceback = ''.join(traceback.format_exception(type(err), err, err.__traceback__))
+		raise
+	return {name: env[name]	for name in writes	if name in env}
+
+class WorkerPool:
+	''' long-lived worker processes executing the submitted functions, they can be killed to interrupt them '''
+	def __init__(self, size):
+		self.tasks = queue.SimpleQueue()
+		self.workers = [Worker(self.tasks)	for i in range(size)]
+	
+	def submit(self, function, *args):
+		''' schedule the execution of function(*args) in a worker, return a Future of its result '''
+		future = futures.Future()
+		self.tasks.put((future, function, args))
+		return future
+	
+	def kill(self):
+		''' interrupt the running functions, the workers will restart for the next ones '''
+		for worker in self.workers:
+			worker.kill()
+	
+	def shutdown(self):
+		''' drop the pending functions and stop the workers '''
+		while True:
+			try:	task = self.tasks.get_nowait()
+			except queue.Empty:	break
+			if task:	task[0].cancel()
+		for worker in self.workers:
+			self.tasks.put(None)
+		self.kill()
+
+class Worker:
+	''' process executing the tasks from a queue one after the other, with a thread in the current process waiting for it '''
+	def __init__(self, tasks):
+		self.tasks = tasks
+		self.process = None
+		self.connection = None
+		self.thread = threading.Thread(target=self._serve, daemon=True)
+		self.thread.start()
+	
+	def _start(self):
+		# spawn workers instead of forking the process running Qt and OpenGL
+		context = multiprocessing.get_context('spawn')
+		self.connection, remote = context.Pipe()
+		self.process = context.Process(target=worker_main, args=(remote,), daemon=True)
+		self.process.start()
+		remote.close()
+	
+	def _serve(self):
+		while True:
+			task = self.tasks.get()
+			# previous results may have been dropped meanwhile
+			releaseblocks()
+			if task is None:	break
+			future, function, args = task
+			if not future.set_running_or_notify_cancel():	continue
+			try:
+				if not self.process or not self.process.is_alive():
+					self._start()
+				self.connection.send((function, args))
+				failed, result = sharedload(*self.connection.recv())
+			except (EOFError, OSError):
+				self.process = None
+				future.set_exception(WorkerDied('the worker process terminated during the execution'))
+			except Exception as err:
+				future.set_exception(err)
+			else:
+				if failed:	future.set_exception(result)
+				else:		future.set_result(result)
+			# do not retain the result until the next task
+			task = future = result = None
+	
+	def kill(self):
+		''' terminate the process, interrupting its current task '''
+		process = self.process
+		if process and process.is_alive():
+			process.kill()
+
+def worker_main(connection):
+	''' loop of a worker process, executing the functions received '''
+	while True:
+		try:
+			function, args = connection.recv()
+		except EOFError:
+			break
+		try:
+			result = (False, function(*args))
+		except Exception as err:
+			result = (True, err)
+		try:
+			message = shareddump(result)
+		except Exception as err:
+			# the exception or the result could not be serialized
+			message = shareddump((True, pickle.PicklingError('{}: {}'.format(type(err).__name__, err))))
+		connection.send(message)
+
+sharedthreshold = 2**16	# size in bytes from which the buffers of a result are transfered in shared memory
+
+def shareddump(obj):
+	''' serialize an object, putting its big buffers in a shared memory block 
+		return the serialized data and the name of the block with the intervals of the buffers in it, or None
+	'''
+	buffers = []
+	def callback(buffer):
+		if buffer.raw().nbytes < sharedthreshold:	return True
+		buffers.append(buffer)
+	data = pickle.dumps(obj, protocol=5, buffer_callback=callback)
+	if not buffers:
+		return data, None
+	spans = bufferspans([buffer.raw()	for buffer in buffers])
+	block = shared_memory.SharedMemory(create=True, size=spans[-1][1])
+	for buffer, (start, stop) in zip(buffers, spans):
+		block.buf[start:stop] = buffer.raw()
+	name = block.name
+	block.close()
+	return data, (name, spans)
+
+_blocks = []	# shared memory blocks received, kept until their buffers are not used anymore
+_blockslock = threading.Lock()
+
+def sharedload(data, block):
+	''' deserialize the result of shareddump, its objects use the shared memory without copying it 
+		the block is kept in _blocks until releaseblocks manages to close it
+	'''
+	buffers = []
+	if block:
+		name, spans = block
+		memory = shared_memory.SharedMemory(name)
+		# the memory stays mapped until closed, it is freed when no process maps it anymore
+		memory.unlink()
+		with _blockslock:
+			_blocks.append(memory)
+		buffers = [memory.buf[start:stop]	for start, stop in spans]
+	return pickle.loads(data, buffers=buffers)
+
+def releaseblocks():
+	''' close the shared memory blocks which buffers are not used anymore '''
+	with _blockslock:
+		for memory in list(_blocks):
+			try:
+				memory.close()
+			except BufferError:
+				continue
+			_blocks.remove(memory)
+
+def bufferspans(buffers):
+	''' intervals of the given buffers placed one after the other, aligned to allow any item type '''
+	spans = []
+	size = 0
+	for buffer in buffers:
+		size += -size % 16
+		spans.append((size, size + buffer.nbytes))
+		size = spans[-1][1]
+	return spans
+
+_pool = (0, None)
+
+def executor(workers):
+	''' worker pool shared by all interpreters, recreated when the number of workers changes '''
+	global _pool
+	if _pool[0] != workers or not _pool[1]:
+		shutdown()
+		_pool = (workers, WorkerPool(workers))
+	return _pool[1]
+
+def shutdown():
+	''' stop the worker processes, and close the shared memory blocks not used anymore '''
+	global _pool
+	if _pool[1]:
+		_pool[1].shutdown()
+	_pool = (0, None)
+	releaseblocks()
+
+def flowmatch(records, statements):
+	''' match the records of a former execution with the given statements, using their normalized AST 
+		return for each statement the index of its matching record or None
+	'''
+	matches = [None] * len(statements)
+	matcher = SequenceMatcher(None, [record.key for record in records], [astkey(stmt) for stmt in statements], autojunk=False)
+	for a, b, size in matcher.get_matching_blocks():
+		for k in range(size):
+			matches[b+k] = a+k
+	return matches
+
+def flowstale(records, matches, statements):
+	''' indices of the matched records that cannot be reused even if the variables they read did not change:
+		- functions keep the globals of the execution that created them
+		- results modified in place by the following records are only valid if the statements using them are all reused
+	'''
+	flows = [stmtflow(stmt)	for stmt in statements]
+	# variables written by each record and modified in place by the following records
+	mutated = {}
+	producers = {}	# index of the last record writing each variable
+	for i, record in enumerate(records):
+		for name in record.modifies:
+			if name in producers:
+				mutated.setdefault(producers[name], set()).add(name)
+		for name in record.writes:
+			producers[name] = i
+	
+	stale = {match	for stmt, match in zip(statements, matches)	if match is not None and defining(stmt)}
+	while True:
+		# records reused, assuming the statements executed change all the variables they write
+		reused = set()
+		tainted = set()
+		consumed = 0
+		for (reads, writes), match in zip(flows, matches):
+			if match is not None:
+				for dropped in records[consumed:match]:
+					tainted.update(dropped.writes)
+				consumed = match+1
+				if match not in stale and tainted.isdisjoint(reads):
+					reused.add(match)
+					tainted.difference_update(records[match].writes)
+					continue
+			tainted.update(writes)
+		invalid = set()
+		# the records modifying results in place must all be reused with the records producing them
+		producers = {}
+		for i, record in enumerate(records):
+			if i not in reused:
+				invalid.update(producers[name]	for name in record.modifies	if producers.get(name) in reused)
+			for name in record.writes:
+				producers[name] = i
+		# the statements executed would get reused results with the modifications of the former execution
+		modified = {}	# index of the reused record producing each variable modified in place
+		for (reads, writes), match in zip(flows, matches):
+			if match in reused:
+				for name in records[match].writes:
+					if name in mutated.get(match, ()):	modified[name] = match
+					else:								modified.pop(name, None)
+			else:
+				invalid.update(modified[name]	for name in reads	if name in modified)
+				for name in writes:
+					modified.pop(name, None)
+		if invalid <= stale:
+			return stale
+		stale |= invalid
+
+def provenance(statements):
+	''' set on each statement a signature of its code and of the code of the statements it depends on
+		unlike the object identities, it is stable from a session to an other
+	'''
+	state = {}	# signature of the last statement having accessed each variable
+	functions = {}	# global variables read by the functions defined, indexed by function name
+	for stmt in statements:
+		reads, writes = varflow(stmt)
+		# a conditional statement may leave the variables it assigns to their former values
+		if conditional(stmt):
+			reads |= writes
+		# calling a function defined in the script reads the global variables it uses
+		called = [name	for name in reads	if name in functions]
+		while called:
+			for name in functions[called.pop()] - reads:
+				reads.add(name)
+				if name in functions:	called.append(name)
+		if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+			functions[stmt.name] = reads
+		stmt.flow = reads, writes
+		
+		signature = hashlib.sha1(astkey(stmt).encode())
+		# a statement reading a variable may also modify the object, and names not found may come from star imports
+		for name in sorted(reads) + ['*']:
+			signature.update(state.get(name, '').encode())
+		stmt.signature = signature.hexdigest()
+		for name in reads | writes:
+			state[name] = stmt.signature
+
+def stmtflow(stmt):
+	''' variables read and written by a top-level statement, including the variables read by the script functions it calls '''
+	if hasattr(stmt, 'flow'):
+		reads, writes = stmt.flow
+		return set(reads), set(writes)
+	reads, writes = varflow(stmt)
+	if conditional(stmt):
+		reads |= writes
+	return reads, writes
+
+def stmtmodifies(stmt, reads):
+	''' variables which objects a top-level statement reading the given variables may modify in place 
+		assignments are assumed to only modify the objects they assign items or attributes of, or augment, other statements are mostly executed for their side effects
+	'''
+	if not isinstance(stmt, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+		return set(reads)
+	modified = set()
+	for target in (stmt.targets if isinstance(stmt, ast.Assign) else [stmt.target]):
+		if isinstance(stmt, ast.AugAssign) and isinstance(target, ast.Name):
+			modified.add(target.id)
+		for node in ast.walk(target):
+			if isinstance(node, (ast.Subscript, ast.Attribute)) and not isinstance(node.ctx, ast.Load):
+				while isinstance(node, (ast.Subscript, ast.Attribute)):
+					node = node.value
+				if isinstance(node, ast.Name):
+					modified.add(node.id)
+	return modified
+
+# statements executing their blocks depending on runtime values
+conditionals = tuple(getattr(ast, name)	for name in ('If', 'For', 'AsyncFor', 'While', 'Try', 'TryStar', 'Match')	if hasattr(ast, name))
+
+def conditional(stmt):
+	''' return True if a top-level statement may not assign all the variables it writes '''
+	return isinstance(stmt, conditionals) or any(isinstance(node, ast.NamedExpr)	for node in ast.walk(stmt))
+
+def madcadversion():
+	''' version of the madcad package, results computed with an other version are not reused '''
+	try:	return importlib.metadata.version('pymadcad')
+	except Exception:	return None
+
+def astkey(node):
+	''' normalized representation of an AST node, independent of its position in the text '''
+	key = getattr(node, 'dump', None)
+	if key is None:
+		key = node.dump = ast.dump(node)
+	return key
+
+def cacheable(stmt):
+	''' return True if the statement is an assignment worth caching, with only variables as targets '''
+	return (	isinstance(stmt, ast.Assign)
+			and	isinstance(stmt.value, (ast.Call, ast.BinOp))
+			and	all(isinstance(target, ast.Name)	for target in stmt.targets)
+			and	not defining(stmt)
+			)
+
+def defining(stmt):
+	''' return True if the statement creates functions or classes, bound to the globals of the environment it is executed in '''
+	return any(isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda))	for node in ast.walk(stmt))
+
+def cachekey(stmt, env):
+	''' key identifying the result of a statement: its normalized AST and the fingerprints of the variables it reads '''
+	reads, writes = varflow(stmt)
+	# functions defined in the script depend on the global variables they use
+	for name in list(reads):
+		func = env.get(name)
+		if isinstance(func, FunctionType) and func.__module__ == env.get('__name__'):
+			reads.update(func.__code__.co_names)
+	return ast.dump(stmt), tuple(fingerprint(env.get(name))	for name in sorted(reads))
+
+def fingerprint(obj):
+	''' value identifying an object as long as it is alive and not mutated: the value itself for immutable builtins, the identity otherwise '''
+	if isinstance(obj, (int, float, complex, str, bytes, type(None))):
+		return type(obj), obj
+	return id(obj)
+
 def copyvars(vars, deep=(), memo=None):
 	''' copy a dictionnary of variables, with only the variables present in deep that are deepcopied '''
 	if memo is None:	memo = {}
@@ -328,6 +1576,28 @@ def varusage(node):
 	astpropagate(node, use)
 	return used, reused
 
+def varflow(node):
+	''' return two sets of variable names: those read and those written by the given ast tree 
+		definitions and imports are considered as writes of their name, a star import writes '*'
+	'''
+	reads = set()
+	writes = set()
+	for child in ast.walk(node):
+		if isinstance(child, ast.Name):
+			if isinstance(child.ctx, ast.Load):
+				reads.add(child.id)
+			else:
+				writes.add(child.id)
+		elif isinstance(child, ast.AugAssign) and isinstance(child.target, ast.Name):
+			# an augmented assignment reads the variable before writing it
+			reads.add(child.target.id)
+		elif isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+			writes.add(child.name)
+		elif isinstance(child, (ast.Import, ast.ImportFrom)):
+			for alias in child.names:
+				writes.add(alias.asname or alias.name.split('.')[0])
+	return reads, writes
+
 def astpropagate(node, process):
 	''' apply process to node's children 
 		if process returns something not None, it's used to inplace replace the child in the node
@@ -351,15 +1621,10 @@ def astannotate(tree, text):
 			* end_position
 	'''	
 	# assigne a text position to each node
-	currentloc = (1,0)
-	currentpos = 0
+	starts = linestarts(text)
 	for node in ast.walk(tree):
 		if hasattr(node, 'lineno'):
-			target = astloc(node)
-			node.position = advancepos(text, target, currentpos, currentloc)
-			currentloc = target
-			currentpos = node.position
-	
+			node.position = starts[node.lineno-1] + node.col_offset
 	
 	# find the end of each node
 	def recursive(node):
@@ -419,42 +1684,60 @@ def astannotate(tree, text):
 
 
 				
-def astshift(tree, loc, pos):
-	''' shift the position attributes of the tree nodes, as if the parsed text was appent to an other string '''
-	def recursive(node):
-		if hasattr(node, 'lineno'):			
-			node.lineno += loc[0]
-			if hasattr(node, 'end_lineno'):		node.end_lineno += loc[0]
-			if hasattr(node, 'position'):		node.position += pos
-			if hasattr(node, 'end_position'):	node.end_position += pos
-			if node.lineno == 0:
-				node.col_offset += loc[1]
-				if hasattr(node, 'end_col_offset'):		node.end_col_offset += loc[1]
-		astpropagate(node, recursive)
-	recursive(tree)
+class Anchor:
+	''' text position and line of a top-level statement, shared by all its nodes
+		moving the statement in the text only needs to move its anchor
+	'''
+	__slots__ = 'position', 'lineno'
+	def __init__(self, position, lineno):
+		self.position = position
+		self.lineno = lineno
+	
+	# the copies of the nodes stay at the place of the original ones
+	def __copy__(self):
+		return self
+	def __deepcopy__(self, memo):
+		return self
+
+def astanchor(tree, pos, lines):
+	''' replace the position attributes set by astannotate by offsets relative to an anchor for each top-level statement
+		pos and lines are the text position and the number of lines before the parsed text
+		line numbers become relative to the first line of the statement
+	'''
+	for statement in tree.body:
+		anchor = Anchor(statement.position + pos, statement.lineno + lines)
+		start, first = statement.position, statement.lineno
+		for node in ast.walk(statement):
+			if hasattr(node, 'position'):
+				node.anchor = anchor
+				node.offset = node.position - start
+				node.end_offset = getattr(node, 'end_position', node.position) - start
+				del node.position
+				if hasattr(node, 'end_position'):	del node.end_position
+		astlines(statement, 1-first)
 
-def advancepos(text, loc, startpos=0, startloc=(1,0), tab=1):
-	''' much like textpos but starts from a point (with startpos and startloc) and can advance forward or backward '''
-	i = startpos
-	l,c = startloc
-	while l < loc[0]:	
-		i = text.find('\n', i)+1
-		l += 1
-	while l > loc[0]:
-		i = text.rfind('\n', 0, i)
-		l -= 1
-	i = text.rfind('\n', 0, i)+1
-	i += loc[1]
-	return i
+def astlines(tree, lines):
+	''' shift the line numbers of the tree nodes '''
+	for node in ast.walk(tree):
+		if getattr(node, 'lineno', None) is not None:			node.lineno += lines
+		if getattr(node, 'end_lineno', None) is not None:		node.end_lineno += lines
+
+def linestarts(text):
+	''' string indices of the beginning of each line '''
+	starts = [0]
+	i = text.find('\n')
+	while i >= 0:
+		starts.append(i+1)
+		i = text.find('\n', i+1)
+	return starts
 		
 	
 		
 def astatpos(tree, pos):
 	''' get the AST node from a list of nodes, that contains the given text location '''
 	for i,statement in enumerate(tree.body):
-		if statement.position >= pos:		
-			return i
-		if hasattr(statement, 'end_position') and statement.end_position > pos:
+		start, end = astinterval(statement)
+		if start >= pos or end > pos:
 			return i
 	return len(tree.body)
 		
@@ -463,33 +1746,20 @@ def astloc(node):
 	return (node.lineno, node.col_offset)
 
 def astinterval(node):
-	return (node.position, node.end_position)
-		
-def textpos(text, loc, tab=1):
-	''' string index of the given text location (line,column) '''
-	i = 0
-	l, c = 1, 0
-	while l < loc[0]:	
-		i = text.find('\n', i)+1
-		l += 1
-	while c < loc[1]:
-		if text[i] == '\t':	c += tab
-		else:				c += 1
-		i += 1
-	return i
-
+	''' text interval of an AST node, placed by its anchor '''
+	position = node.anchor.position
+	return (position + node.offset, position + node.end_offset)
+		
 def textloc(text, pos, tab=1, start=(1,0)):
 	''' text location for the given string index '''
 	if pos < 0:	pos += len(text)
-	l, c = start
 	if pos > len(text):	
 		raise IndexError('the given position is not in the string')
-	for i,char in enumerate(text):
-		if i >= pos:	break
-		if char == '\n':
-			l += 1
-			c = 1
-		elif char == '\t':
+	line = text.count('\n', 0, pos)
+	linestart = text.rfind('\n', 0, pos)+1
+	l, c = start[0] + line, (start[1] if not line else 0)
+	for char in text[linestart:pos]:
+		if char == '\t':
 			c += tab
 			c -= c%tab
 		else:
@@ -513,7 +1783,7 @@ def normalizeindent(text):
 def astexpruntil(tree, pos):
 	remains = []
 	def recur(node):
-		if isinstance(node, ast.expr) and node.end_position <= pos:
+		if isinstance(node, ast.expr) and astinterval(node)[1] <= pos:
 			if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):	return
 			remains.append(node)
 		else:
@@ -523,6 +1793,7 @@ def astexpruntil(tree, pos):
 	return [ast.Expr(r, 
 				lineno=r.lineno, 
 				col_offset=r.col_offset,
-				position=r.position, 
-				end_position=r.end_position) 	
+				anchor=r.anchor,
+				offset=r.offset, 
+				end_offset=r.end_offset) 	
 			for r in remains]
@@ -20,6 +20,7 @@ from PyQt5.QtGui import (
 from madcad import *
 from madcad.rendering import Display, displayable, Displayable, Step, Group, Turntable, Orbit, Perspective, Orthographic
 from madcad.displays import SolidDisplay, WebDisplay, GridDisplay
+from madcad.mesh import NMesh, typedlist_to_numpy
 import madcad
 
 from .common import *
@@ -31,6 +32,9 @@ import ast
 from copy import deepcopy, copy
 from weakref import WeakValueDictionary
 from operator import itemgetter
+from madcad.mathutils import bisect
+from hashlib import blake2b
+import numpy as np
 
 
 QEventGLContextChange = 215	# opengl context change event type, not yet defined in PyQt5
@@ -60,10 +64,18 @@ class Scene(madcad.rendering.Scene, QObject):
 		self.active_solid = None	# current solid for current space
 		self.active_selection = None	# key of the last selected display
 		self.executed = True	# flag set to True to enable a full relead of the scene
+		self.sources = {}		# objects from the interpreter environment currently displayed, by variable name
+		self.zonenames = {}		# variable names in each display zone
+		self.extra = {}			# editors and additions currently displayed
+		self.syncstate = None	# inputs of the last sync, None to check everything at the next one
 		self.displayall = False
 		self.displaynone = False
 		self.selected = False
+		self.selection = {}		# selected displays indexed by their key in the scene, in selection order
 		
+		self.fragments = {}		# rendering frames of each display: (display, frames, annotation frames)
+		self.annotated = set()		# keys of the displays having annotation frames
+		self.stackoptions = None	# options the fragments were stacked with
 		self.cache = WeakValueDictionary()	# prevent loading multiple times the same object
 		self.recursion_check = set()  # prevent reference-loop in groups (groups are taken from the execution env, so the user may not want to display it however we are trying to)
 	
@@ -76,38 +88,98 @@ class Scene(madcad.rendering.Scene, QObject):
 		self.sync()
 	
 	def sync(self):
-		# objects selection in env, and already present objs
+		''' update the displays from the interpreter environment, the display zones and the scene settings 
+			only the variables that may have changed since the last sync are checked
+		'''
 		main = self.main
 		it = main.interpreter
-		newscene = {}
+		state = self.syncstate
+		
+		# names of the variables which display may have changed, None for all
+		names = set()
+		executed = not state or state['env'] is not it.current
+		if (	not state 
+			or	state['flags'] != (self.displayall, self.displaynone)
+			or	executed and (state['runs']+1 != it.runs or it.changed is None)
+			):
+			names = None
+		else:
+			if executed:
+				names |= it.changed
+			names |= state['showset'] ^ self.showset
+			names |= state['hideset'] ^ self.hideset
+		
+		# names in the display zones, the location index changes with the executions
+		zones = dict(main.displayzones)
+		zonenames = self.zonenames
+		for key in zones.keys() | zonenames.keys():
+			if executed or not state or zones.get(key) != state['zones'].get(key):
+				former = zonenames.pop(key, set())
+				if key in zones:
+					zonenames[key] = {name	for ts,te,name in it.index.inside(*zones[key])}
+				if names is not None:
+					names |= former
+					names |= zonenames.get(key, set())
+		
+		self.syncstate = {
+			'env': it.current,
+			'runs': it.runs,
+			'flags': (self.displayall, self.displaynone),
+			'showset': set(self.showset),
+			'hideset': set(self.hideset),
+			'zones': zones,
+			}
 		
-		# display objects that are requested by the user, or that are never been used (lastly generated)
-		for name,obj in it.current.items():
-			if name in self.hideset:	continue
-			if name in self.showset or self.displayall or (name in it.neverused and not self.displaynone) and name in it.locations:
-				if displayable(obj):
-					newscene[name] = obj
-		
-		# display objects in the display zones
-		for zs,ze in main.displayzones.values():
-			for name,node in it.locations.items():
-				if name not in newscene and name in it.current:
-					ts,te = astinterval(node)
-					temp = it.current[name]
-					if zs <= ts and te <= ze and displayable(temp) and type(temp) not in (list, dict):
-						newscene[name] = temp
-		# add scene's own additions
-		newscene.update(main.editors)
-		newscene.update(self.additions)
+		# update the objects taken from the environment
+		sources = self.sources
+		if names is None:
+			names = it.current.keys() | sources.keys()
+		changed = set()
+		for name in names:
+			obj = self.source(name)
+			if obj is None:
+				if sources.pop(name, None) is not None:
+					changed.add(name)
+			elif sources.get(name) is not obj or executed and (it.changed is None or name in it.changed):
+				sources[name] = obj
+				changed.add(name)
+		
+		# scene's own additions and editors take precedence over the environment
+		extra = {**main.editors, **self.additions}
+		for key in extra.keys() | self.extra.keys():
+			if extra.get(key) is not self.extra.get(key):
+				changed.add(key)
+		self.extra = extra
 		
 		# update the scene
-		super().sync(newscene)
+		objs = {}
+		for key in changed:
+			obj = extra.get(key, sources.get(key))
+			if obj is None:
+				del self[key]
+			else:
+				objs[key] = obj
+		self.update(objs)
 		# perform other actions on sync
 		self.dequeue()
 		
 		self.update_solidsets()
 		# trigger the signal for dependent widgets
 		self.changed.emit()
+	
+	def source(self, name):
+		''' object of the environment to display for the given variable name, or None '''
+		it = self.main.interpreter
+		obj = it.current.get(name)
+		if obj is None or not displayable(obj):
+			return None
+		# display objects that are requested by the user, or that are never been used (lastly generated)
+		if name not in self.hideset and (name in self.showset or self.displayall or (name in it.neverused and not self.displaynone) and name in it.locations):
+			return obj
+		# display objects in the display zones
+		if type(obj) not in (list, dict) and any(name in zone	for zone in self.zonenames.values()):
+			return obj
+		return None
 		
 	def touch(self):
 		self.changed.emit()
@@ -117,41 +189,110 @@ class Scene(madcad.rendering.Scene, QObject):
 		if not objs:    return
 		for k,v in objs.items():
 			disp = self.displays.get(k)
-			if self.executed or not disp or type(getattr(disp, 'source', None)) != type(v):	# with a normal scene, self.executed would be the only condition, but scene elements like editors can be inserted by the interface
+			if self.executed or not disp or getattr(disp, 'source', None) is not v:	# with a normal scene, self.executed would be the only condition, but scene elements like editors can be inserted by the interface
+				# an object computed again with the same geometry keeps its display and GPU buffers
+				if (disp and type(getattr(disp, 'source', None)) is type(v)
+					and getattr(disp, 'fingerprint', None) is not None
+					and disp.fingerprint == geometryprint(v)):
+					disp.source = v
+					self.queue.pop(k, None)
+					continue
 				self.queue[k] = v
 		self.executed = False
 		self.touch()
 		
+	def dequeue(self):
+		# the displays updated in place may render differently
+		for key in self.queue:
+			self.unstack(key)
+		super().dequeue()
+	
 	def restack(self):
 		''' update the rendering calls stack from the current scene's displays.
+			the frames of each display are kept, only the displays added or replaced since the last restack are stacked and inserted in the sorted stacks
 			this is called automatically on `dequeue()`
 		'''
-		# recreate stacks
-		for stack in self.stacks.values():
-			stack.clear()
+		# the options change the frames of every display
+		if self.stackoptions != self.options:
+			self.stackoptions = dict(self.options)
+			for stack in self.stacks.values():
+				stack.clear()
+			self.fragments.clear()
+			self.annotated.clear()
+		# drop the frames of removed displays
+		for key in [key	for key, fragment in self.fragments.items()	if self.displays.get(key) is not fragment[0]]:
+			self.unstack(key)
+		restacked = set()
 		for key,display in self.displays.items():
+			if key in self.fragments:	continue
+			restacked.add(key)
+			frames = []
+			annotations = []
 			for frame in display.stack(self):
 				if len(frame) != 4:
 					raise ValueError('wrong frame format in the stack from {}\n\t got {}'.format(display, frame))
 				sub,target,priority,func = frame
 				full = (key,*sub)
+				entry = (full, priority, func)
 				
 				# try special behaviors
-				try:	i = full.index('annotations')
-				except ValueError:	pass
+				if 'annotations' in full:
+					annotations.append([target, entry, False])
 				else:
-					if i:	disp = self.item(full[:i+1])
-					else:	disp = self
-					if not self.options['display_annotations'] and not disp.selected:
-						continue
-				
-				if target not in self.stacks:	self.stacks[target] = []
-				stack = self.stacks[target]
-				stack.append((full, priority, func))
-		# sort the stack using the specified priorities
-		for stack in self.stacks.values():
-			stack.sort(key=itemgetter(1))
+					stackinsert(self.stacks.setdefault(target, []), entry)
+					frames.append((target, entry))
+			self.fragments[key] = (display, frames, annotations)
+			if annotations:
+				self.annotated.add(key)
+		# the displays stacked again may have been replaced or removed with their selection
+		for key in [key	for key in self.selection	if key[0] in restacked or key[0] not in self.displays]:
+			try:	disp = self.resolve(key)
+			except (KeyError, IndexError, TypeError):	disp = None
+			if disp is not self.selection[key] or not disp.selected:
+				del self.selection[key]
+		
+		# the annotations displayed depend on the selection
+		for key in self.annotated:
+			for annotation in self.fragments[key][2]:
+				target, (full, priority, func), inserted = annotation
+				i = full.index('annotations')
+				if i:	disp = self.item(full[:i+1])
+				else:	disp = self
+				shown = self.options['display_annotations'] or disp.selected
+				if shown != inserted:
+					stack = self.stacks.setdefault(target, [])
+					if shown:	stackinsert(stack, annotation[1])
+					else:		stackremove(stack, annotation[1])
+					annotation[2] = shown
 		self.touched = False
+	
+	def resolve(self, key):
+		''' display at the given key path, each element of the path being a key in the display containing the next one '''
+		disp = self.displays[key[0]]
+		for sub in key[1:]:
+			disp = disp[sub]
+		return disp
+	
+	def select(self, key, state=True):
+		''' set the selection state of the display at the given key path, keeping the selection up to date '''
+		disp = self.resolve(key)
+		disp.selected = state
+		if state:	self.selection[key] = disp
+		else:		self.selection.pop(key, None)
+		return disp
+	
+	def unstack(self, key):
+		''' remove the frames of the given display from the rendering stacks, it will be stacked again at the next restack '''
+		fragment = self.fragments.pop(key, None)
+		if not fragment:	return
+		self.annotated.discard(key)
+		display, frames, annotations = fragment
+		for target, entry in frames:
+			stackremove(self.stacks.get(target, []), entry)
+		for target, entry, inserted in annotations:
+			if inserted:
+				stackremove(self.stacks.get(target, []), entry)
+		self.touched = True
 		
 	#def display(self, obj):		# NOTE will prevent different group from showing the same object, this is not desirable
 		#ido = id(obj)
@@ -170,12 +311,18 @@ class Scene(madcad.rendering.Scene, QObject):
 		assert ido not in self.recursion_check, 'there should not be recursion loops in cascading displays'
 		
 		self.recursion_check.add(ido)
-		try:		disp = super().display(obj, former)
+		try:
+			# a mesh with the same topology only updates the buffers of its former display
+			if former and patchdisplay(former, obj):
+				disp = former
+			else:
+				disp = super().display(obj, former)
 		except Exception as err:     
 			self.main.showerror(err)
 			raise
 		finally:	self.recursion_check.remove(ido)
 		disp.source = obj
+		disp.fingerprint = geometryprint(obj)
 		return disp
 		
 	def update_solidsets(self):
@@ -272,15 +419,182 @@ class Scene(madcad.rendering.Scene, QObject):
 		
 	def selectionbox(self):
 		''' return the bounding box of the selection '''
-		def selbox(level):
-			box = Box(fvec3(inf), fvec3(-inf))
-			for disp in level:
-				if isinstance(disp, Group):
-					box.union(selbox(disp.displays.values()))
-				elif disp.selected:
-					box.union(disp.box.transform(disp.world))
-			return box
-		return selbox(self.displays.values())
+		box = Box(fvec3(inf), fvec3(-inf))
+		for disp in self.selection.values():
+			if not isinstance(disp, Group):
+				box.union(disp.box.transform(disp.world))
+		return box
+
+def geometryprint(obj):
+	''' hash of the content of a mesh, identifying its display as long as the mesh is not mutated, None for the other objects '''
+	if not isinstance(obj, NMesh):
+		return None
+	digest = blake2b(digest_size=16)
+	for field in type(obj).__slots__:
+		value = getattr(obj, field)
+		try:	digest.update(memoryview(value))
+		except TypeError:	digest.update(repr(value).encode())
+		digest.update(b'\0')
+	return digest.digest()
+
+def stackinsert(stack, entry):
+	''' insert a frame in a stack sorted by priority, after the frames of same priority '''
+	i = bisect(stack, entry[1], key=itemgetter(1))
+	while i < len(stack) and stack[i][1] <= entry[1]:
+		i += 1
+	stack.insert(i, entry)
+
+def stackremove(stack, entry):
+	''' remove a frame from a stack sorted by priority, if present '''
+	i = bisect(stack, entry[1], key=itemgetter(1))
+	while i > 0 and stack[i-1][1] == entry[1]:
+		i -= 1
+	while i < len(stack) and stack[i][1] == entry[1]:
+		if stack[i] is entry:
+			del stack[i]
+			return
+		i += 1
+
+patchlimit = 0.25	# maximum ratio of moved points for which a display is patched rather than created again
+
+def patchdisplay(disp, mesh):
+	''' update the vertex buffers of a mesh display to the given mesh, having the same topology as the former source 
+		only the ranges of vertices moved and of normals changed are written to the GPU
+		return False if the display cannot be patched
+		
+		the vertices duplicated at sharp edges are those of the display creation, until it is created again
+	'''
+	former = getattr(disp, 'source', None)
+	# a mesh modified in place cannot be compared to its former state
+	if former is mesh:
+		return False
+	if not (type(former) is type(mesh) 
+			and	type(disp) in (SolidDisplay, WebDisplay) 
+			and	len(former.points) == len(mesh.points)):
+		return False
+	try:
+		if not (	type(former).__slots__ == type(mesh).__slots__
+				and	all(bytes(memoryview(getattr(former, field))) == bytes(memoryview(getattr(mesh, field)))
+						for field in type(mesh).__slots__	if field not in ('points', 'groups', 'options'))
+				and	former.groups == mesh.groups
+				and	former.options == mesh.options):
+			return False
+	except (TypeError, ValueError):
+		return False
+	
+	old = typedlist_to_numpy(former.points, 'f8')
+	new = typedlist_to_numpy(mesh.points, 'f8')
+	moved = np.flatnonzero((old != new).any(axis=1))
+	if len(moved) > patchlimit * len(new):
+		return False
+	if not len(moved):
+		return True
+	
+	cache = getattr(disp, 'patchcache', None) or patchcache(disp, former)
+	if not cache:
+		return False
+	disp.patchcache = cache
+	positions = cache['positions']
+	origin, shared, sortedorigin = cache['origin'], cache['shared'], cache['sortedorigin']
+	
+	# display vertices duplicating the moved points
+	spans = np.searchsorted(sortedorigin, moved), np.searchsorted(sortedorigin, moved, side='right')
+	vertices = np.concatenate([shared[start:stop]	for start, stop in zip(*spans)] + [np.empty(0, int)])
+	positions[vertices] = new[origin[vertices]]
+	writeranges(disp.vertices.vb_positions, positions, vertices)
+	
+	if isinstance(disp, SolidDisplay):
+		normals, faces, adjacency = cache['normals'], cache['faces'], cache['adjacency']
+		# normals change on the vertices of the faces around the moved vertices
+		around = np.unique(faces[vertexfaces(adjacency, vertices)])
+		contributing = vertexfaces(adjacency, around)
+		corners = faces[contributing]
+		local, inverse = np.unique(corners, return_inverse=True)
+		inverse = inverse.reshape(corners.shape)
+		sums = np.zeros((len(local), 3))
+		
+		# same weighting as Mesh.vertexnormals
+		pts = positions[corners].astype('f8')
+		facenormals = np.cross(pts[:,1]-pts[:,0], pts[:,2]-pts[:,0])
+		with np.errstate(divide='ignore', invalid='ignore'):
+			facenormals /= np.linalg.norm(facenormals, axis=1)[:,None]
+			valid = np.isfinite(facenormals).all(axis=1)
+			for i in range(3):
+				a = pts[:,i-2] - pts[:,i]
+				b = pts[:,i-1] - pts[:,i]
+				angle = np.arctan2(np.linalg.norm(np.cross(a, b), axis=1), (a*b).sum(axis=1))
+				inner = valid & ~cache['border'][corners[:,i]]
+				np.add.at(sums, inverse[inner,i], angle[inner,None] * facenormals[inner])
+				outline = valid & cache['outline'][contributing,i]
+				np.add.at(sums, inverse[outline,i], facenormals[outline])
+				np.add.at(sums, inverse[outline,i-1], facenormals[outline])
+			sums /= np.linalg.norm(sums, axis=1)[:,None]
+		update = np.searchsorted(local, around)
+		normals[around] = sums[update]
+		writeranges(disp.disp_faces.vb_normals, normals, around)
+		writeranges(disp.disp_ghost.vb_normals, normals, around)
+	
+	disp.box = madcad.displays.npboundingbox(positions)
+	return True
+
+def patchcache(disp, mesh):
+	''' data needed to patch a display, read back from its buffers once '''
+	positions = np.frombuffer(disp.vertices.vb_positions.read(), 'f4').reshape(-1,3).copy()
+	# vertex duplicating each point of the source, deduced from the face or edge indices before and after the display duplications
+	if isinstance(disp, SolidDisplay):
+		if not disp.disp_faces.va:	return None
+		faces = np.frombuffer(disp.disp_faces.vb_faces.read(), 'u4').reshape(-1,3).astype(np.int64)
+		source = typedlist_to_numpy(mesh.faces, 'i8')
+	else:
+		if not disp.disp_edges.va:	return None
+		faces = np.frombuffer(disp.disp_edges.vb_lines.read(), 'u4').reshape(-1,2).astype(np.int64)
+		tracks = typedlist_to_numpy(mesh.tracks, 'i8')
+		# the web display puts the edges group by group
+		order = np.argsort(tracks, kind='stable')
+		source = typedlist_to_numpy(mesh.edges, 'i8')[order[tracks[order] < len(mesh.groups)]]
+	if source.shape != faces.shape:
+		return None
+	origin = np.arange(len(positions))
+	origin[faces.ravel()] = source.ravel()
+	shared = np.argsort(origin, kind='stable')
+	cache = {
+		'positions': positions,
+		'origin': origin,
+		'shared': shared,
+		'sortedorigin': origin[shared],
+		}
+	if isinstance(disp, SolidDisplay):
+		# oriented edges without opposite are on the outline, their vertices do not weight normals by angle
+		count = len(positions)
+		ends = np.roll(faces, 1, axis=1)
+		keys = (ends * count + faces).ravel()
+		outline = ~np.isin((faces * count + ends).ravel(), keys)
+		border = np.zeros(count, bool)
+		border[faces.ravel()[outline]] = True
+		border[ends.ravel()[outline]] = True
+		order = np.argsort(faces.ravel(), kind='stable')
+		cache.update({
+			'normals': np.frombuffer(disp.disp_faces.vb_normals.read(), 'f4').reshape(-1,3).copy(),
+			'faces': faces,
+			'outline': outline.reshape(faces.shape),
+			'border': border,
+			'adjacency': (order // 3, np.searchsorted(faces.ravel()[order], np.arange(count+1))),
+			})
+	return cache
+
+def vertexfaces(adjacency, vertices):
+	''' indices of the faces using the given vertices '''
+	faces, starts = adjacency
+	return np.unique(np.concatenate([faces[starts[v]:starts[v+1]]	for v in vertices] + [np.empty(0, int)]))
+
+def writeranges(buffer, array, indices, gap=64):
+	''' write the rows of array at the given indices to the buffer, merging the ranges separated by less than gap rows '''
+	indices = np.unique(indices)
+	if not len(indices):	return
+	breaks = np.flatnonzero(np.diff(indices) > gap)
+	row = array.itemsize * array.shape[1]
+	for start, stop in zip(indices[np.r_[0, breaks+1]], indices[np.r_[breaks, len(indices)-1]]+1):
+		buffer.write(np.ascontiguousarray(array[start:stop], 'f4').tobytes(), offset=int(start)*row)
 
 def scene_unroll(scene):
 	''' yield recursively all displays in the scene, including subscenes '''
@@ -452,14 +766,15 @@ class SceneView(madcad.rendering.View):
 			# select what is under cursor
 			if type(disp).__name__ in ('SolidDisplay', 'WebDisplay'):
 				disp.vertices.selectsub(key[-1])
-				disp.selected = any(disp.vertices.flags & 0x1)
+				self.scene.select(key[:-1], any(disp.vertices.flags & 0x1))
 			else:
-				disp.selected = not disp.selected
+				self.scene.select(key[:-1], not disp.selected)
 			# make sure that a display is selected if one of its sub displays is
-			for disp in reversed(stack):
+			for i in reversed(range(len(stack))):
+				disp = stack[i]
 				if hasattr(disp, '__iter__'):
-					disp.selected = any(sub.selected	for sub in disp)
-			self.scene.selected = any(sub.selected    for sub in self.scene.displays.values())
+					self.scene.select(key[:i+1], any(sub.selected	for sub in disp))
+			self.scene.selected = any(len(selected) == 1	for selected in self.scene.selection)
 			
 			if disp.selected:
 				self.scene.active_selection = key
@@ -610,7 +925,7 @@ class SceneView(madcad.rendering.View):
 		it = self.main.interpreter
 		if not hasattr(disp, 'source') or id(disp.source) not in it.ids:	
 			return
-		self.main.active_scriptview.seek_position(it.locations[it.ids[id(disp.source)]].position)
+		self.main.active_scriptview.seek_position(astinterval(it.locations[it.ids[id(disp.source)]])[0])
 		self.main.active_scriptview.editor.setFocus(True)
 		
 
@@ -228,8 +228,7 @@ class ScriptView(QWidget):
 		
 		if cursor.hasSelection():
 			start, stop = cursor.selectionStart(), cursor.selectionEnd()
-			for location in main.interpreter.locations.values():
-				zone = astinterval(location)
+			for zone in main.interpreter.index.overlap(start, stop):
 				if start <= zone[0] <= stop or start <= zone[1] <= stop:
 					start = min(start, zone[0])
 					stop = max(stop, zone[0])
@@ -248,6 +247,7 @@ class ScriptView(QWidget):
 		else:
 			main.displayzones.pop(id(self), None)
 		
+		main.update_capture()
 		main.updatescript()
 		if main.active_sceneview:
 			main.active_sceneview.scene.sync()
@@ -12,8 +12,14 @@ from .common import ressourcedir
 execution = {
 	'onstartup': True,			# execution at program startup
 	'trigger': 1,				# execution trigger: {0: manual, 1: on line change, 2: on typing}
+	'triggerdelay': 0.1,		# minimum delay after the last edition before an automatic execution, it grows with the duration of the recent executions
 	'steptime': 0.1,			# execution time tolerated between backups, if a block runs a longer time, the interpreter will start create a backup
 	'checkdanger': 'startup',	# when to check for dangerous code ('never'/False, 'startup'/True, 'always')
+	'parallel': 0,				# number of worker processes executing independent statements concurrently, 0 to disable
+	'isolated': False,			# execute the assignments calling functions in worker processes, allowing to interrupt them; other statements still run in the interface process
+								# only assignments are sent to the workers, not those calling methods of variables since they may modify them
+	'backupmemory': 2000,		# memory in MB allowed for the backups of the execution, the backups the cheapest to recompute are dropped beyond
+	'temporaries': 'all',		# statements keeping their temporary values: 'all', or only the 'displayed' ones (under cursor or in display zones)
 	}
 	
 view = {
@@ -55,6 +61,8 @@ locations = {
 	'pysettings': configdir+'/madcad/pymadcad.yaml',
 	'colors_presets': configdir+'/madcad/color-presets.yaml',
 	'startup': configdir+'/madcad/startup.py',
+	'backups': configdir+'/madcad/backups',
+	'cache': configdir+'/madcad/cache',
 	}
 
 settings = {'execution':execution, 'view':view, 'scriptview':scriptview}
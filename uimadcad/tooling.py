@@ -12,8 +12,7 @@ from madcad.nprint import nformat
 
 from madcad import *
 
-from .interpreter import astatpos
-from .sceneview import scene_unroll
+from .interpreter import astatpos, astinterval
 
 
 class ToolError(Exception):
@@ -171,7 +170,7 @@ def islive(main, name):
 	'''
 	if name in main.interpreter.locations:
 		node = main.interpreter.locations[name]
-		return main.interpreter.ast_end >= node.end_position
+		return main.interpreter.ast_end >= astinterval(node)[1]
 	return False
 
 def istemp(main, name):
@@ -205,27 +204,28 @@ def rename(main, oldname, newname=None):
 	node = main.interpreter.locations[oldname]
 	# the renamed object already has a variable name
 	if isinstance(node, ast.Assign):
-		zone = node.targets[0]
-		main.mod[zone.position:zone.end_position] = newname
+		start, end = astinterval(node.targets[0])
+		main.mod[start:end] = newname
 	
 	# the renamed object is a temporary variable
 	else:
-		stmt = main.interpreter.ast.body[astatpos(main.interpreter.ast, node.position)]
+		start, end = astinterval(node)
+		stmt = main.interpreter.ast.body[astatpos(main.interpreter.ast, start)]
 		
 		# the expression result is not used, just assign it
-		if isinstance(stmt, ast.Expr) and stmt.position == node.position and stmt.end_position == node.end_position:
+		if isinstance(stmt, ast.Expr) and astinterval(stmt) == (start, end):
 			# just insert the assignation
-			main.mod[node.position] = '{} = '.format(newname)
+			main.mod[start] = '{} = '.format(newname)
 		# the expression result is used, move it and assign it
 		else:
 			# get and remove the expression
 			cursor = QTextCursor(main.script)
-			cursor.setPosition(node.position)
-			cursor.setPosition(node.end_position, QTextCursor.KeepAnchor)
+			cursor.setPosition(start)
+			cursor.setPosition(end, QTextCursor.KeepAnchor)
 			expr = cursor.selectedText()
-			main.mod[node.position:node.end_position] = newname
+			main.mod[start:end] = newname
 			# insert expression with assignation
-			main.mod[stmt.position] = '{} = {}\n'.format(newname, expr)
+			main.mod[astinterval(stmt)[0]] = '{} = {}\n'.format(newname, expr)
 	main.interpreter.current[newname] = main.interpreter.current.get(oldname)
 			
 def autoname(main, obj):
@@ -282,14 +282,13 @@ def toolrequest(main, args, create=True):
 	env = main.interpreter.current
 	
 	# search the selection for the required objects
-	for disp in scene_unroll(main.active_sceneview.scene):
-		if disp.selected:
-			var = dispvar(main, disp)
-			if var:
-				for i,(req,comment) in enumerate(args):
-					if not match[i] and satisfy(var.value, req):
-						match[i] = var
-						break
+	for disp in main.active_sceneview.scene.selection.values():
+		var = dispvar(main, disp)
+		if var:
+			for i,(req,comment) in enumerate(args):
+				if not match[i] and satisfy(var.value, req):
+					match[i] = var
+					break
 	
 	for i,var in enumerate(match):
 		if var:
@@ -313,11 +312,10 @@ def requestmany(main, req, description='', create=True):
 	''' give as many of one element as requested '''
 	vars = []
 	# take all satisfying selected objects from the scene
-	for disp in scene_unroll(main.active_sceneview.scene):
-		if disp.selected:
-			var = dispvar(main, disp)
-			if var and req(var.value):
-				vars.append(acquirevar(main, var))
+	for disp in list(main.active_sceneview.scene.selection.values()):
+		var = dispvar(main, disp)
+		if var and req(var.value):
+			vars.append(acquirevar(main, var))
 	# if there is no such selection, generate an unlimited quantity
 	if not vars and create and req in completition:
 		main.assist.info(description)
@@ -360,11 +358,12 @@ def select(main, req):
 		pos = view.somenear(evt.pos())
 		if not pos:	
 			continue
-		disp = view.scene.item(view.itemat(pos))
+		key = view.itemat(pos)
+		disp = view.scene.item(key)
 		var = dispvar(main, disp)
 		if not var or not satisfy(var.value, req):
 			continue
-		disp.selected = True
+		view.scene.select(key[:-1])
 		# create proper variables for temp objects reused
 		return acquirevar(main, var)
 	
@@ -481,12 +480,11 @@ def create_toolbars(main, widget):
 
 
 def act_rename(main):
-	for disp in scene_unroll(main.active_sceneview.scene):
-		if disp.selected:
-			var = dispvar(main, disp)
-			if var:
-				rename(main, var.name)
-				break
+	for disp in main.active_sceneview.scene.selection.values():
+		var = dispvar(main, disp)
+		if var:
+			rename(main, var.name)
+			break
 
 def tool_import(main):
 	filename = QFileDialog.getOpenFileName(main.mainwindow, 'import file', 
@@ -731,11 +729,10 @@ def tool_onplane(main):
 				])
 	pts = []
 	
-	for disp in scene_unroll(main.active_sceneview.scene):
-		if disp.selected:
-			var = dispvar(main, disp)
-			if var and isinstance(var.value, vec3):
-				pts.append(var)
+	for disp in main.active_sceneview.scene.selection.values():
+		var = dispvar(main, disp)
+		if var and isinstance(var.value, vec3):
+			pts.append(var)
 	
 	# let the user select or create the points to put on the plane
 	if not pts:
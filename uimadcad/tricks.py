@@ -7,6 +7,8 @@ from madcad import *
 from madcad.displays import *
 from madcad.nprint import nprint
 
+from .interpreter import astinterval
+
 
 
 format_varname = r'[a-zA-Z]\w*'
@@ -28,10 +30,11 @@ class EditorNode:
 		if isinstance(node, ast.Assign):	node = node.value
 		
 		# double cursor to allow undo without loosing the start/end positions in the text
+		position, end_position = astinterval(node)
 		start = QTextCursor(self.main.script)
-		start.setPosition(node.position-1)
+		start.setPosition(position-1)
 		stop = QTextCursor(start)
-		stop.setPosition(node.end_position+1)
+		stop.setPosition(end_position+1)
 		self.cursors = (start, stop)
 		
 		self.load(node)
@@ -126,7 +129,8 @@ class MeshEditor(EditorNode):
 					else:
 						match = False
 						break
-			text = self.main.interpreter.text[node.position:node.end_position]
+			start, end = astinterval(node)
+			text = self.main.interpreter.text[start:end]
 			args[name] = None if match else text
 		
 		self.exprs = args